@@ -0,0 +1,576 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Offline load test: in-process stand-ins for guilds, members, invites and channels
+# drive main.py's event handlers and slash commands, no Discord connection needed.
+#   python bench.py                                  every scenario, one process each
+#   python bench.py --scenario raid --scale 0.1      a single scenario, in this process
+#   python bench.py --baseline old.json              flag regressions against an earlier run
+
+SCENARIOS = ("raid", "bot_raid", "trickle", "burst", "mass_leave", "many_invites", "big_db")
+HERE = os.path.dirname(os.path.abspath(__file__))
+GUILD_ID = 900000000000000001
+LOG_CHANNEL, WELCOME_CHANNEL, TOP_CHANNEL, TOP_MESSAGE = 1001, 1002, 1003, 1004
+REWARD_ROLES = {5: 2001, 20: 2002, 100: 2003}
+
+api = collections.Counter()
+api_latency = 0.0
+snowflakes = iter(range(10**17, 10**18))
+
+async def api_call(name):
+    api[name] += 1
+    if api_latency: await asyncio.sleep(api_latency)
+
+class FakeUser:
+    __slots__ = ("id",)
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+        self.mention = f"<@&{role_id}>"
+
+class FakeInvite:
+    __slots__ = ("code", "uses", "inviter")
+
+    def __init__(self, code, uses, inviter):
+        self.code = code
+        self.uses = uses
+        self.inviter = inviter
+
+class FakeMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, content=None, embed=None):
+        await api_call("message.edit")
+
+class FakeChannel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+
+    async def send(self, content=None, embed=None, embeds=None):
+        await api_call("channel.send")
+        return FakeMessage(self, next(snowflakes))
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id)
+
+    async def create_invite(self, **kwargs):
+        await api_call("channel.create_invite")
+        invite = FakeInvite(f"p{next(snowflakes)}", 0, FakeUser(0))
+        self.guild.invite_list.append(invite)
+        return invite
+
+class FakeMember:
+    __slots__ = ("guild", "id", "created_at", "joined_at", "roles", "premium_since", "avatar")
+
+    def __init__(self, guild, member_id, created_at, joined_at):
+        self.guild = guild
+        self.id = member_id
+        self.created_at = created_at
+        self.joined_at = joined_at
+        self.roles = []
+        self.premium_since = None
+        self.avatar = None
+
+    @property
+    def mention(self): return f"<@{self.id}>"
+
+    @property
+    def display_name(self): return f"member-{self.id}"
+
+    async def kick(self, reason=None):
+        await api_call("member.kick")
+        self.guild.member_map.pop(self.id, None)
+
+    async def add_roles(self, *roles, reason=None):
+        await api_call("member.add_roles")
+        self.roles.extend(roles)
+
+class FakeGuild:
+    def __init__(self, guild_id, invites, inviters):
+        self.id = guild_id
+        self.chunked = True
+        self.member_map = {}
+        self.channels = {i: FakeChannel(self, i) for i in (LOG_CHANNEL, WELCOME_CHANNEL, TOP_CHANNEL)}
+        self.roles = {role_id: FakeRole(role_id) for role_id in REWARD_ROLES.values()}
+        self.clock = datetime.datetime.now(datetime.timezone.utc)
+        self.inviter_ids = [next(snowflakes) for _ in range(inviters)]
+        for inviter_id in self.inviter_ids: self.add_member(inviter_id, age_days=365)
+        self.invite_list = [FakeInvite(f"c{i}", 0, FakeUser(self.inviter_ids[i % inviters])) for i in range(invites)]
+
+    @property
+    def members(self): return list(self.member_map.values())
+
+    def get_member(self, member_id): return self.member_map.get(member_id)
+    def get_channel(self, channel_id): return self.channels.get(channel_id)
+    def get_role(self, role_id): return self.roles.get(role_id)
+
+    async def invites(self):
+        await api_call("guild.invites")
+        return [FakeInvite(i.code, i.uses, i.inviter) for i in self.invite_list]
+
+    def add_member(self, member_id=None, age_days=30):
+        # strictly increasing join times that still track the wall clock
+        self.clock = max(self.clock + datetime.timedelta(microseconds=1), datetime.datetime.now(datetime.timezone.utc))
+        member_id = member_id or next(snowflakes)
+        member = self.member_map[member_id] = FakeMember(self, member_id, self.clock - datetime.timedelta(days=age_days), self.clock)
+        return member
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    def is_done(self): return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        await api_call("interaction.respond")
+
+    async def defer(self, **kwargs):
+        self.done = True
+        await api_call("interaction.defer")
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        await api_call("interaction.followup")
+
+class FakeInteraction:
+    def __init__(self, guild, user):
+        self.guild = guild
+        self.user = user
+        self.channel = guild.channels[LOG_CHANNEL]
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class Samples:
+    def __init__(self):
+        self.values = collections.defaultdict(list)
+
+    def add(self, name, seconds):
+        self.values[name].append(seconds)
+
+    def summary(self):
+        result = {}
+        for name, values in sorted(self.values.items()):
+            values = sorted(values)
+            result[name] = {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.5) * 1000, 4),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 4),
+                "max_ms": round(values[-1] * 1000, 4),
+            }
+        return result
+
+def rss_mb():
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+class Bench:
+    def __init__(self, main, rng):
+        self.main = main
+        self.bot = main.bot
+        self.rng = rng
+        self.samples = Samples()
+        self.submitted = {}
+        self.young = 0
+        # member -> inviter whose link they actually used, to check attribution against
+        self.truth = {}
+        self.misattributed = collections.Counter()
+        self.true_fakes = collections.Counter()
+        self.raid_fakes = collections.Counter()
+        self.raid_held = 0
+        self.result = {}
+        self.instrument()
+
+    def instrument(self):
+        # wrap (not replace) the pieces whose latency isn't visible from the handler call
+        main, bot, samples = self.main, self.bot, self.samples
+        credit_join = main.credit_join
+        async def timed_credit(member, inviter_id):
+            if inviter_id != self.truth.get(member.id, inviter_id): self.misattributed["young" if main.is_young_account(member) else "real"] += 1
+            await credit_join(member, inviter_id)
+            started = self.submitted.pop(member.id, None)
+            if started: samples.add("join_to_credit", time.perf_counter() - started)
+        main.credit_join = timed_credit
+
+        render = bot.leaderboard.render
+        async def timed_render(guild):
+            started = time.perf_counter()
+            await render(guild)
+            samples.add("leaderboard_render", time.perf_counter() - started)
+        bot.leaderboard.render = timed_render
+
+        summarize = bot.raid.summarize
+        def counted_summarize(raid):
+            self.raid_fakes.update(raid.fakes)
+            self.raid_held += raid.held
+            summarize(raid)
+        bot.raid.summarize = counted_summarize
+
+        flush = bot.store.flush
+        async def timed_flush():
+            flushes, started = bot.store.flushes, time.perf_counter()
+            await flush()
+            if bot.store.flushes > flushes: samples.add("flush", time.perf_counter() - started)
+        bot.store.flush = timed_flush
+
+    def guild(self, invites, inviters):
+        guild = FakeGuild(GUILD_ID, invites, inviters)
+        db = self.bot.db
+        db["log_channels"][guild.id] = LOG_CHANNEL
+        db["welcome_channels"][guild.id] = WELCOME_CHANNEL
+        db["top_messages"][guild.id] = {"channel": TOP_CHANNEL, "message": TOP_MESSAGE}
+        db["rewards_config"][guild.id] = dict(REWARD_ROLES)
+        self.bot.store.mark_dirty()
+        return guild
+
+    async def warm(self, guild):
+        with self.timed("warmup"): await self.main.warm_guild(guild, asyncio.Semaphore(1))
+
+    def timed(self, name):
+        samples = self.samples
+        class Timer:
+            def __enter__(self): self.started = time.perf_counter()
+            def __exit__(self, *exc): samples.add(name, time.perf_counter() - self.started)
+        return Timer()
+
+    async def join(self, guild, young=False):
+        member = guild.add_member(age_days=0 if young else 30)
+        self.young += young
+        invite = guild.invite_list[self.rng.randrange(len(guild.invite_list))]
+        invite.uses += 1
+        self.truth[member.id] = invite.inviter.id
+        if young: self.true_fakes[invite.inviter.id] += 1
+        self.submitted[member.id] = time.perf_counter()
+        with self.timed("member_join"): await self.main.on_member_join(member)
+        return member
+
+    async def leave(self, member):
+        member.guild.member_map.pop(member.id, None)
+        with self.timed("member_remove"): await self.main.on_member_remove(member)
+
+    async def commands(self, guild, count):
+        inviters = guild.inviter_ids
+        for _ in range(count):
+            member = guild.get_member(self.rng.choice(inviters))
+            with self.timed("cmd_rank"): await self.main.rank_cmd.callback(FakeInteraction(guild, member), None)
+            with self.timed("cmd_check_user"): await self.main.check_user.callback(FakeInteraction(guild, member), member)
+        with self.timed("update_leaderboard"): await self.main.update_leaderboard(guild)
+
+    def seed(self, guild, records):
+        # write history straight into the db, the way it would look after `records` joins
+        main, db = self.main, self.bot.db
+        invited_by = db["invited_by"].setdefault(guild.id, {})
+        history = db["invite_history"].setdefault(guild.id, {})
+        points = collections.Counter()
+        inviters = guild.inviter_ids
+        members = []
+        for i in range(records):
+            member_id, inviter_id = next(snowflakes), inviters[i % len(inviters)]
+            invited_by[member_id] = main.Invitation(inviter_id)
+            history.setdefault(inviter_id, main.IdSet()).add(member_id)
+            points[inviter_id] += 1
+            members.append(member_id)
+        db["real_invites"].setdefault(guild.id, {}).update(points)
+        self.bot.rankings.pop(guild.id, None)
+        self.bot.store.mark_dirty()
+        return members
+
+    async def settle(self, timeout=300):
+        bot = self.bot
+        deadline = time.monotonic() + timeout
+        while bot.attributor.workers or bot.raid.watchers or bot.notifier.tasks or bot.leaderboard.tasks:
+            if time.monotonic() > deadline: raise TimeoutError("handlers still busy after the scenario finished")
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(max(api_latency * 2, 0.01))
+
+    async def resolve_pending(self, guild):
+        # what an admin would do with /assign_join: pick the inviter whose link was really used
+        pending = self.bot.db.get("pending_joins", {}).get(guild.id, {})
+        found = {"pending_joins": len(pending), "pending_young": sum(entry["young"] for entry in pending.values()), "pending_without_inviter": 0}
+        for member_id, entry in list(pending.items()):
+            inviter = guild.get_member(self.truth[member_id])
+            if inviter.id not in entry["candidates"]:
+                found["pending_without_inviter"] += 1
+                continue
+            self.submitted.pop(member_id, None)
+            await self.main.assign_join.callback(FakeInteraction(guild, inviter), str(member_id), inviter)
+        await self.settle()
+        return found
+
+    async def full_flush(self):
+        self.bot.store.mark_dirty()
+        started = time.perf_counter()
+        await self.bot.store.flush()
+        return round(time.perf_counter() - started, 4)
+
+    def load_time(self):
+        main = self.main
+        started = time.perf_counter()
+        if main.STORAGE_ENGINE == "sqlite":
+            store = main.SqliteStore(main.SQLITE_FILE)
+            store.conn.close()
+        else: main.load_data(main.DATA_FILE)
+        return round(time.perf_counter() - started, 4)
+
+async def yield_every(i, n):
+    if i % n == 0: await asyncio.sleep(0)
+
+async def scenario_raid(bench, scale):
+    guild = bench.guild(invites=200, inviters=200)
+    await bench.warm(guild)
+    for i in range(int(10000 * scale)):
+        await bench.join(guild, young=bench.rng.random() < 0.2)
+        await yield_every(i, 50)
+    await bench.settle()
+    await bench.commands(guild, 200)
+    return guild
+
+async def scenario_bot_raid(bench, scale):
+    # every join a throwaway account, the usual shape of a raid
+    guild = bench.guild(invites=200, inviters=200)
+    await bench.warm(guild)
+    for i in range(int(5000 * scale)):
+        await bench.join(guild, young=True)
+        await yield_every(i, 50)
+    await bench.settle()
+    return guild
+
+async def scenario_trickle(bench, scale):
+    guild = bench.guild(invites=50, inviters=50)
+    await bench.warm(guild)
+    # 20 joins/s, under the raid threshold
+    for _ in range(int(500 * scale)):
+        await bench.join(guild, young=bench.rng.random() < 0.05)
+        await asyncio.sleep(0.05)
+    await bench.settle()
+    await bench.commands(guild, 200)
+    return guild
+
+async def scenario_burst(bench, scale):
+    guild = bench.guild(invites=5, inviters=5)
+    await bench.warm(guild)
+    # ~16 joins/s over a handful of links: too slow for raid mode, too fast for one join per fetch
+    for _ in range(int(1000 * scale)):
+        await bench.join(guild)
+        await asyncio.sleep(0.06)
+    await bench.settle()
+    return guild
+
+async def scenario_mass_leave(bench, scale):
+    guild = bench.guild(invites=200, inviters=200)
+    member_ids = bench.seed(guild, int(10000 * scale))
+    await bench.warm(guild)
+    members = [guild.add_member(member_id) for member_id in member_ids]
+    bench.rng.shuffle(members)
+    for i, member in enumerate(members):
+        await bench.leave(member)
+        await yield_every(i, 50)
+    await bench.settle()
+    await bench.commands(guild, 200)
+    return guild
+
+async def scenario_many_invites(bench, scale):
+    guild = bench.guild(invites=5000, inviters=1000)
+    await bench.warm(guild)
+    for _ in range(int(2000 * scale)):
+        await bench.join(guild)
+        await asyncio.sleep(0.002)
+    await bench.settle()
+    await bench.commands(guild, 200)
+    return guild
+
+async def scenario_big_db(bench, scale):
+    guild = bench.guild(invites=500, inviters=10000)
+    member_ids = bench.seed(guild, int(1000000 * scale))
+    bench.result["seed_rss_mb"] = rss_mb()
+    bench.result["full_flush_s"] = await bench.full_flush()
+    bench.result["load_s"] = bench.load_time()
+    await bench.warm(guild)
+    leavers = [guild.add_member(member_id) for member_id in bench.rng.sample(member_ids, min(len(member_ids), 1000))]
+    for i, member in enumerate(leavers):
+        await bench.join(guild)
+        await bench.leave(member)
+        await yield_every(i, 10)
+    await bench.settle()
+    await bench.commands(guild, 200)
+    return guild
+
+async def run_scenario(main, name, args):
+    bench = Bench(main, random.Random(args.seed))
+    bot = bench.bot
+    bot.store.start()
+    started = time.perf_counter()
+    guild = await globals()[f"scenario_{name}"](bench, args.scale)
+    elapsed = time.perf_counter() - started
+    calls = dict(api)
+    pending = await bench.resolve_pending(guild)
+    final_flush = await bench.full_flush()
+    await bot.store.close()
+    path = main.SQLITE_FILE if main.STORAGE_ENGINE == "sqlite" else main.DATA_FILE
+    save = main.metrics.histograms.get(("save_seconds", ()))
+    bench.result.update({
+        "elapsed_s": round(elapsed, 3),
+        "latency": bench.samples.summary(),
+        "api_calls": dict(sorted(calls.items())),
+        "api_calls_total": sum(calls.values()),
+        "persistence": {
+            "flushes": save.count if save else 0,
+            "flush_total_s": round(save.total, 4) if save else 0.0,
+            "final_full_flush_s": final_flush,
+            "size_bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+        },
+        "joins": bot.attributor.joins,
+        "invite_fetches": bot.attributor.fetches,
+        # left for /assign_join, then settled with the true inviter before the counts below
+        **pending,
+        "young_joins": bench.young,
+        "fake_invites_counted": sum(sum(counts.values()) for counts in bot.db["fake_invite_counts"].values()),
+        "raid_held": bench.raid_held,
+        "raids": main.metrics.counters.get(("raids_total", ()), 0),
+        # credits (and fake counts) that went to someone other than the inviter whose link was used
+        "misattributed_joins": bench.misattributed["real"],
+        "misattributed_fakes": bench.misattributed["young"],
+        # fake counts and raid summaries per inviter, against how many young accounts really came through their links
+        "fake_counts_overcharged": sum(max(0, count - bench.true_fakes[user_id]) for counts in bot.db["fake_invite_counts"].values() for user_id, count in counts.items()),
+        "raid_fakes_overcharged": sum(max(0, count - bench.true_fakes[user_id]) for user_id, count in bench.raid_fakes.items()),
+        "fake_counts_missing": sum(max(0, count - bot.db["fake_invite_counts"].get(GUILD_ID, {}).get(user_id, 0)) for user_id, count in bench.true_fakes.items()),
+        "leaderboard": dict(bot.leaderboard.stats),
+        "notifier": dict(bot.notifier.stats),
+        "peak_rss_mb": rss_mb(),
+    })
+    return bench.result
+
+def run_here(name, args):
+    global api_latency
+    api_latency = args.api_latency / 1000
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["DATA_FILE"] = os.path.join(workdir, "bot_data.json")
+        os.environ["SQLITE_FILE"] = os.path.join(workdir, "bot_data.sqlite3")
+        os.environ["STORAGE_ENGINE"] = args.engine
+        os.environ.setdefault("JOIN_BATCH_WINDOW", "0.05")
+        os.environ.setdefault("LEADERBOARD_INTERVAL", "0.25")
+        os.environ.setdefault("SAVE_INTERVAL", "1")
+        os.environ.setdefault("RAID_WINDOW", "1")
+        sys.path.insert(0, HERE)
+        started_rss = rss_mb()
+        main = importlib.import_module("main")
+        result = {"import_rss_mb": rss_mb(), "python_rss_mb": started_rss}
+        result.update(asyncio.run(run_scenario(main, name, args)))
+        return result
+
+def run_child(name, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        out = os.path.join(workdir, "result.json")
+        cmd = [sys.executable, os.path.abspath(__file__), "--scenario", name, "--out", out, "--scale", str(args.scale),
+               "--engine", args.engine, "--api-latency", str(args.api_latency), "--seed", str(args.seed)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        # a child that only failed the attribution check still wrote its results
+        if not os.path.exists(out):
+            print(proc.stdout + proc.stderr, file=sys.stderr)
+            return {"error": f"exit code {proc.returncode}"}
+        with open(out, encoding="utf-8") as f:
+            return json.load(f)["scenarios"][name]
+
+def git_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+def print_result(name, result):
+    if "error" in result:
+        print(f"❌ {name}: {result['error']}")
+        return
+    print(f"▶ {name}  {result['elapsed_s']}s  api={result['api_calls_total']}  rss={result['peak_rss_mb']}MB  "
+          f"flushes={result['persistence']['flushes']} ({result['persistence']['flush_total_s']}s)  final_flush={result['persistence']['final_full_flush_s']}s")
+    for metric, stats in result["latency"].items():
+        print(f"    {metric:<20} n={stats['count']:<7} p50={stats['p50_ms']:.3f}ms  p99={stats['p99_ms']:.3f}ms  max={stats['max_ms']:.3f}ms")
+
+def regressions(baseline, current, tolerance):
+    # only things that should never get worse: tail latency, API calls, memory, save time
+    found = []
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old or "error" in old or "error" in result: continue
+        # the last field is an absolute floor so sub-millisecond jitter isn't reported
+        checks = [(f"{metric}.p99_ms", stats["p99_ms"], old["latency"].get(metric, {}).get("p99_ms"), 1.0) for metric, stats in result["latency"].items()]
+        checks += [("api_calls_total", result["api_calls_total"], old["api_calls_total"], 0),
+                   ("peak_rss_mb", result["peak_rss_mb"], old["peak_rss_mb"], 5.0),
+                   ("final_full_flush_s", result["persistence"]["final_full_flush_s"], old["persistence"]["final_full_flush_s"], 0.05)]
+        for metric, new_value, old_value, floor in checks:
+            if old_value and new_value > old_value * (1 + tolerance) and new_value - old_value > floor:
+                found.append(f"{name} {metric}: {old_value} → {new_value} (x{new_value / old_value:.2f})")
+    return found
+
+def attribution_errors(current):
+    # unlike the timings these have to be exactly zero, baseline or not
+    found = []
+    for name, result in current["scenarios"].items():
+        for metric in ("misattributed_joins", "misattributed_fakes", "fake_counts_overcharged", "raid_fakes_overcharged", "fake_counts_missing", "pending_without_inviter"):
+            if result.get(metric): found.append(f"{name} {metric}: {result[metric]}")
+    return found
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Replay join/leave storms against main.py with fake Discord objects")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append", help="run only these (in this process when given once)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every scenario's size, e.g. 0.1 for a quick run")
+    parser.add_argument("--engine", choices=("json", "sqlite"), default=os.getenv("STORAGE_ENGINE", "json").lower())
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated ms per Discord API call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "engine": args.engine,
+        "scale": args.scale,
+        "api_latency_ms": args.api_latency,
+        "scenarios": {},
+    }
+    for name in names:
+        # each scenario gets a fresh process: main.py keeps the bot in a module global and RSS only grows
+        report["scenarios"][name] = run_here(name, args) if len(names) == 1 else run_child(name, args)
+        print_result(name, report["scenarios"][name])
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 บันทึกผลไว้ที่ {args.out}")
+
+    wrong = attribution_errors(report)
+    for line in wrong: print(f"❌ ให้แต้มผิดคน: {line}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(json.load(f), report, args.tolerance)
+        for line in found: print(f"⚠️ ช้าลง: {line}")
+        if found: sys.exit(1)
+        print("✅ ไม่มีค่าที่แย่ลงเกินเกณฑ์")
+    if wrong: sys.exit(1)
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,32 +3,117 @@ from discord.ext import commands, tasks
 from discord import app_commands
 import json
 import os
-import psutil 
+import gzip
+import sys
+import signal
+import sqlite3
+import tempfile
 import asyncio
-from flask import Flask
-from threading import Thread
+import bisect
+import collections
+import contextlib
+import heapq
+import itertools
+import time
+try: import fcntl
+except ImportError: fcntl = None
+from aiohttp import web
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask("")
-@app.route("/")
-def home(): return "Bot is online and running!"
-def run(): app.run(host="0.0.0.0", port=8080)
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
-
-DATA_FILE = "bot_data.json"
-
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            data.setdefault("invite_history", {}) 
-            data.setdefault("fake_invite_counts", {})
-            data.setdefault("multipliers", {})
-            return data
+HTTP_PORT = int(os.getenv("PORT", 8080))
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        if i < len(self.counts): self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+def format_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Metrics:
+    # Minimal Prometheus registry: counters and histograms recorded as things happen,
+    # gauges are read from the bot's state at scrape time.
+    def __init__(self, prefix="invitebot"):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.loop_lag = 0.0
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None: histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self, gauges=()):
+        lines, typed = [], set()
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in sorted(self.counters.items()):
+            header(f"{self.prefix}_{name}", "counter")
+            lines.append(f"{self.prefix}_{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            full = f"{self.prefix}_{name}"
+            header(full, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{full}_sum{format_labels(labels)} {histogram.total}")
+            lines.append(f"{full}_count{format_labels(labels)} {histogram.count}")
+        for name, labels, value in gauges:
+            header(f"{self.prefix}_{name}", "gauge")
+            lines.append(f"{self.prefix}_{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# SHARD_IDS means this process is one worker of a sharded deployment (see supervisor.py):
+# it only loads and writes its own guilds' rows, so the data lives in the shared SQLite file
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0)) or None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+WORKER_ID = int(os.getenv("WORKER_ID", 0))
+SHARD_STALE = 60
+
+DATA_FILE = os.getenv("DATA_FILE", "bot_data.json")
+STORAGE_ENGINE = "sqlite" if SHARD_IDS else os.getenv("STORAGE_ENGINE", "json").lower()
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot_data.sqlite3")
+SAVE_INTERVAL = float(os.getenv("SAVE_INTERVAL", 5))
+SAVE_MAX_CHANGES = int(os.getenv("SAVE_MAX_CHANGES", 200))
+TOUCHED_LIMIT = int(os.getenv("TOUCHED_LIMIT", 100000))
+SAVE_BUCKETS = 256
+SAVE_CHUNK = int(os.getenv("SAVE_CHUNK", 20000))
+BACKUP_CHUNK = int(os.getenv("BACKUP_CHUNK", 2000))
+ATTACHMENT_LIMIT = int(os.getenv("ATTACHMENT_LIMIT", 10 * 1024 * 1024))
+
+def empty_data():
     return {
         "rewards_config": {},  
         "log_channels": {},    
@@ -41,9 +126,597 @@ def load_data():
         "multipliers": {}
     }
 
+class Invitation:
+    __slots__ = ("inviter", "points")
+
+    def __init__(self, inviter, points=1):
+        self.inviter = inviter
+        self.points = points
+
+class IdSet:
+    # insertion-ordered set of member ids, O(1) add/discard (invite_history used to be lists)
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids=()):
+        self._ids = dict.fromkeys(ids)
+
+    def add(self, member_id): self._ids[member_id] = None
+    def discard(self, member_id): self._ids.pop(member_id, None)
+    def __contains__(self, member_id): return member_id in self._ids
+    def __iter__(self): return iter(self._ids)
+    def __len__(self): return len(self._ids)
+
+# In memory every guild/user key is an int snowflake; these sections also key their
+# per-guild dict by user id (or points) and get converted once at load time.
+INT_KEYED = {"real_invites", "fake_invite_counts", "rewards_config", "personal_links", "pending_joins"}
+
+class IdInterner(dict):
+    # snowflakes are bigger than the small-int cache, so without this every occurrence
+    # of the same id (invited_by key, history entry, inviter) would be its own object
+    def __missing__(self, key):
+        value = self[key] = int(key)
+        return value
+
+def normalize_section(section, value, ids=None):
+    ids = IdInterner() if ids is None else ids
+    if section == "invited_by":
+        return {ids[m]: Invitation(ids[v]) if isinstance(v, str) else Invitation(ids[v["inviter"]], v["points"]) for m, v in value.items()}
+    if section == "invite_history":
+        return {ids[i]: IdSet(ids[m] for m in members) for i, members in value.items()}
+    if section in INT_KEYED:
+        return {ids[k]: v for k, v in value.items()}
+    if section == "campaign_points":
+        return {campaign_id: {ids[u]: p for u, p in points.items()} for campaign_id, points in value.items()}
+    return value
+
+def normalize_data(raw):
+    data, ids = empty_data(), IdInterner()
+    for section, guilds in raw.items():
+        data[section] = {ids[guild_id]: normalize_section(section, value, ids) for guild_id, value in guilds.items()}
+    return data
+
+def encode_record(obj):
+    if isinstance(obj, Invitation): return {"inviter": str(obj.inviter), "points": obj.points}
+    if isinstance(obj, IdSet): return [str(member_id) for member_id in obj]
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def load_data(path=DATA_FILE):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return normalize_data(json.load(f))
+    return empty_data()
+
+def dump_data(data):
+    # int keys become the usual string keys, so the file layout doesn't change
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=encode_record).encode("utf-8")
+
+def write_atomic(path, parts):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.writelines(parts)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    write_atomic(DATA_FILE, [dump_data(data)])
+
+# per-user sections; their JSON is cached per bucket of keys, so one join re-encodes a
+# few thousand records instead of the guild's whole history
+SAVE_SPLIT = {"invited_by", "invite_history", "real_invites", "fake_invite_counts", "personal_links", "pending_joins"}
+
+class DataStore:
+    # Write-behind: handlers only mark the db dirty, one flush per interval (or per
+    # max_changes) writes the file in a thread. The encoded JSON is cached per section and
+    # guild (per key bucket for SAVE_SPLIT sections) and a flush only encodes what was
+    # marked dirty since, one piece at a time between yields to the loop.
+    def __init__(self, data, interval=SAVE_INTERVAL, max_changes=SAVE_MAX_CHANGES):
+        self.data = data
+        self.interval = interval
+        self.max_changes = max_changes
+        self.changes = 0
+        self.flushes = 0
+        self.fragments = {}
+        self.buckets = {}
+        self.touched = {}
+        self.touched_since = time.time()
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    def mark_dirty(self, section=None, guild_id=None, key=None):
+        self.changes += 1
+        self.touch(section, guild_id, key)
+        self._stale(section, guild_id, key)
+        if self.changes >= self.max_changes: self._wake.set()
+
+    def _stale(self, section, guild_id, key):
+        # drops the cached JSON of whatever changed
+        if section is None:
+            self.fragments.clear()
+            self.buckets.clear()
+        elif guild_id is None:
+            for piece in [p for p in self.fragments if p[0] == section]: del self.fragments[piece]
+            for piece in [p for p in self.buckets if p[0] == section]: del self.buckets[piece]
+        elif key is None or (section, guild_id) not in self.buckets:
+            self.fragments.pop((section, guild_id), None)
+            self.buckets.pop((section, guild_id), None)
+        else:
+            bucket = key % SAVE_BUCKETS
+            self.buckets[(section, guild_id)].setdefault(bucket, set()).add(key)
+            self.fragments.get((section, guild_id), {}).pop(bucket, None)
+
+    def touch(self, section, guild_id, key):
+        # keys changed per guild since its last backup; a change without a guild resets tracking
+        if guild_id is None:
+            self.touched.clear()
+            self.touched_since = time.time()
+            return
+        keys = self.touched.setdefault(guild_id, set())
+        if keys is None: return
+        keys.add((section, key))
+        if len(keys) > TOUCHED_LIMIT: self.touched[guild_id] = None
+
+    def take_touched(self, guild_id, since):
+        # None when the changes since `since` aren't fully known (restart, reset or overflow)
+        keys = self.touched.pop(guild_id, set())
+        if keys is None or since is None or since < self.touched_since: return None
+        return keys
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            await self.flush()
+
+    def _take(self):
+        pending, self.changes = self.changes, 0
+        return pending
+
+    def _requeue(self, pending):
+        self.changes += pending
+
+    async def _encode(self, pause):
+        # fills in every missing fragment; with `pause` it yields after each one, so what
+        # was encoded early may be marked dirty again before the pass is over
+        for section, guilds in list(self.data.items()):
+            for guild_id, value in list(guilds.items()):
+                piece = (section, guild_id)
+                if section not in SAVE_SPLIT:
+                    if piece not in self.fragments:
+                        self.fragments[piece] = {None: dump_data(value)}
+                        if pause: await asyncio.sleep(0)
+                    continue
+                groups = self.buckets.get(piece)
+                if groups is None:
+                    # keys added while this yields are put in their bucket by _stale
+                    groups = self.buckets[piece] = {}
+                    self.fragments[piece] = {}
+                    keys = list(value)
+                    for i in range(0, len(keys), SAVE_CHUNK):
+                        for key in keys[i:i + SAVE_CHUNK]: groups.setdefault(key % SAVE_BUCKETS, set()).add(key)
+                        if pause: await asyncio.sleep(0)
+                cached = self.fragments.setdefault(piece, {})
+                for bucket in [b for b in groups if b not in cached]:
+                    if self.buckets.get(piece) is not groups: break
+                    keys = groups.pop(bucket)
+                    items = {key: value[key] for key in keys if key in value}
+                    if not items: continue
+                    groups[bucket] = set(items)
+                    cached[bucket] = dump_data(items)[1:-1]
+                    if pause: await asyncio.sleep(0)
+
+    def _assemble(self):
+        # the document as a list of byte strings for the writer thread
+        parts = [b"{"]
+        for i, (section, guilds) in enumerate(self.data.items()):
+            parts.append(b"%s%s:{" % (b"," if i else b"", json.dumps(section, ensure_ascii=False).encode("utf-8")))
+            for j, guild_id in enumerate(guilds):
+                parts.append(b'%s"%s":' % (b"," if j else b"", str(guild_id).encode()))
+                cached = self.fragments[(section, guild_id)]
+                if None in cached:
+                    parts.append(cached[None])
+                    continue
+                parts.append(b"{")
+                for k, fragment in enumerate(cached.values()): parts += [b"," if k else b"", fragment]
+                parts.append(b"}")
+            parts.append(b"}")
+        parts.append(b"}")
+        return parts
+
+    async def _snapshot(self, pending):
+        await self._encode(pause=True)
+        # a last pass without yields re-encodes what changed meanwhile, so the file is
+        # still a single point in time
+        await self._encode(pause=False)
+        return self._assemble()
+
+    def _write(self, payload):
+        write_atomic(DATA_FILE, payload)
+
+    def _size(self, payload):
+        return "save_bytes_total", sum(map(len, payload))
+
+    async def flush(self):
+        async with self._lock:
+            if not self.changes: return
+            pending = self._take()
+            started = time.perf_counter()
+            payload = await self._snapshot(pending)
+            try:
+                await asyncio.to_thread(self._write, payload)
+                self.flushes += 1
+                metrics.observe("save_seconds", time.perf_counter() - started)
+                metrics.inc(*self._size(payload))
+            except (OSError, sqlite3.Error) as e:
+                self._requeue(pending)
+                print(f"❌ บันทึกข้อมูลไม่สำเร็จ: {e}")
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS real_invites (guild_id INTEGER, user_id INTEGER, points INTEGER, PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS real_invites_rank ON real_invites (guild_id, points DESC);
+CREATE TABLE IF NOT EXISTS invited_by (guild_id INTEGER, member_id INTEGER, inviter_id INTEGER, points INTEGER, PRIMARY KEY (guild_id, member_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS invited_by_inviter ON invited_by (guild_id, inviter_id);
+CREATE TABLE IF NOT EXISTS invite_history (guild_id INTEGER, inviter_id INTEGER, member_id INTEGER, position INTEGER, PRIMARY KEY (guild_id, inviter_id, member_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS fake_invite_counts (guild_id INTEGER, user_id INTEGER, count INTEGER, PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS multipliers (guild_id INTEGER PRIMARY KEY, multiplier INTEGER);
+CREATE TABLE IF NOT EXISTS log_channels (guild_id INTEGER PRIMARY KEY, channel_id INTEGER);
+CREATE TABLE IF NOT EXISTS welcome_channels (guild_id INTEGER PRIMARY KEY, channel_id INTEGER);
+CREATE TABLE IF NOT EXISTS shard_stats (shard_id INTEGER PRIMARY KEY, worker INTEGER, pid INTEGER, guilds INTEGER, members INTEGER, latency REAL, queued_joins INTEGER, updated_at REAL);
+CREATE TABLE IF NOT EXISTS top_messages (guild_id INTEGER PRIMARY KEY, channel_id INTEGER, message_id INTEGER);
+CREATE TABLE IF NOT EXISTS rewards_config (guild_id INTEGER, points INTEGER, role_id INTEGER, PRIMARY KEY (guild_id, points)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pending_joins (guild_id INTEGER, member_id INTEGER, young INTEGER, at INTEGER, candidates TEXT, PRIMARY KEY (guild_id, member_id)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS extra (section TEXT, guild_id TEXT, value TEXT, PRIMARY KEY (section, guild_id)) WITHOUT ROWID;
+"""
+
+# sections whose per-guild dict is split into one row per key; the rest are one row per guild
+SQLITE_KEYED = {"real_invites": "user_id", "invited_by": "member_id", "invite_history": "inviter_id", "fake_invite_counts": "user_id", "pending_joins": "member_id"}
+SQLITE_INSERT = {
+    "real_invites": "INSERT OR REPLACE INTO real_invites VALUES (?, ?, ?)",
+    "invited_by": "INSERT OR REPLACE INTO invited_by VALUES (?, ?, ?, ?)",
+    "invite_history": "INSERT OR REPLACE INTO invite_history VALUES (?, ?, ?, ?)",
+    "fake_invite_counts": "INSERT OR REPLACE INTO fake_invite_counts VALUES (?, ?, ?)",
+    "multipliers": "INSERT OR REPLACE INTO multipliers VALUES (?, ?)",
+    "log_channels": "INSERT OR REPLACE INTO log_channels VALUES (?, ?)",
+    "welcome_channels": "INSERT OR REPLACE INTO welcome_channels VALUES (?, ?)",
+    "top_messages": "INSERT OR REPLACE INTO top_messages VALUES (?, ?, ?)",
+    "rewards_config": "INSERT OR REPLACE INTO rewards_config VALUES (?, ?, ?)",
+    "pending_joins": "INSERT OR REPLACE INTO pending_joins VALUES (?, ?, ?, ?, ?)",
+}
+
+def sqlite_rows(section, guild_id, key, value):
+    if section == "invited_by":
+        return [(guild_id, key, value.inviter, value.points)]
+    if section == "invite_history":
+        return [(guild_id, key, member_id, pos) for pos, member_id in enumerate(value)]
+    if section in ("real_invites", "fake_invite_counts"):
+        return [(guild_id, key, value)]
+    if section == "top_messages":
+        return [(guild_id, value["channel"], value["message"])]
+    if section == "rewards_config":
+        return [(guild_id, points, role_id) for points, role_id in value.items()]
+    if section == "pending_joins":
+        return [(guild_id, key, int(value["young"]), value["at"], json.dumps(value["candidates"]))]
+    return [(guild_id, value)]
+
+class SqliteStore(DataStore):
+    # Same in-memory db dict as the JSON engine, but flushes only write the rows
+    # that were marked dirty, in one small transaction per flush.
+    def __init__(self, path=SQLITE_FILE, shards=None, **kwargs):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # shards=(count, ids): only those shards' guilds are loaded, and whole-table rewrites
+        # leave the other workers' rows alone
+        self.scope = shard_scope("guild_id", shards)
+        self.extra_scope = shard_scope("CAST(guild_id AS INTEGER)", shards)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.dirty = set()
+        super().__init__(self._load(), **kwargs)
+
+    def _load(self):
+        data, ids = empty_data(), IdInterner()
+        for g, u, p in self.conn.execute("SELECT guild_id, user_id, points FROM real_invites WHERE 1" + self.scope):
+            data["real_invites"].setdefault(ids[g], {})[ids[u]] = p
+        for g, m, i, p in self.conn.execute("SELECT guild_id, member_id, inviter_id, points FROM invited_by WHERE 1" + self.scope):
+            data["invited_by"].setdefault(ids[g], {})[ids[m]] = Invitation(ids[i], p)
+        for g, i, m in self.conn.execute(f"SELECT guild_id, inviter_id, member_id FROM invite_history WHERE 1{self.scope} ORDER BY guild_id, inviter_id, position"):
+            data["invite_history"].setdefault(ids[g], {}).setdefault(ids[i], IdSet()).add(ids[m])
+        for g, u, c in self.conn.execute("SELECT guild_id, user_id, count FROM fake_invite_counts WHERE 1" + self.scope):
+            data["fake_invite_counts"].setdefault(g, {})[u] = c
+        for section in ("multipliers", "log_channels", "welcome_channels"):
+            for g, v in self.conn.execute(f"SELECT * FROM {section} WHERE 1{self.scope}"):
+                data[section][g] = v
+        for g, c, m in self.conn.execute("SELECT guild_id, channel_id, message_id FROM top_messages WHERE 1" + self.scope):
+            data["top_messages"][g] = {"channel": c, "message": m}
+        for g, p, r in self.conn.execute(f"SELECT guild_id, points, role_id FROM rewards_config WHERE 1{self.scope} ORDER BY guild_id, points"):
+            data["rewards_config"].setdefault(g, {})[p] = r
+        for g, m, y, a, c in self.conn.execute("SELECT guild_id, member_id, young, at, candidates FROM pending_joins WHERE 1" + self.scope):
+            data.setdefault("pending_joins", {}).setdefault(ids[g], {})[ids[m]] = {"candidates": json.loads(c), "young": bool(y), "at": a}
+        for section, g, v in self.conn.execute("SELECT section, guild_id, value FROM extra WHERE 1" + self.extra_scope):
+            data.setdefault(section, {})[int(g)] = normalize_section(section, json.loads(v))
+        return data
+
+    def _stale(self, section, guild_id, key):
+        self.dirty.add((section, guild_id, key))
+
+    def _take(self):
+        pending = (self.dirty, self.changes)
+        self.dirty, self.changes = set(), 0
+        return pending
+
+    def _requeue(self, pending):
+        self.dirty |= pending[0]
+        self.changes += pending[1]
+
+    def _ops(self, section, guild_id, key):
+        ops = []
+        if section not in SQLITE_INSERT:
+            guilds = [guild_id] if guild_id is not None else list(self.data.get(section, {}))
+            if guild_id is None: ops.append(("DELETE FROM extra WHERE section = ?" + self.extra_scope, [(section,)]))
+            for g in guilds:
+                value = self.data.get(section, {}).get(g)
+                if value is None: ops.append(("DELETE FROM extra WHERE section = ? AND guild_id = ?", [(section, str(g))]))
+                else: ops.append(("INSERT OR REPLACE INTO extra VALUES (?, ?, ?)", [(section, str(g), json.dumps(value, ensure_ascii=False, default=encode_record))]))
+            return ops
+        if guild_id is None:
+            ops.append((f"DELETE FROM {section} WHERE 1{self.scope}", [()]))
+            for g in list(self.data.get(section, {})): ops += self._ops(section, g, None)[1:]
+            return ops
+        g = guild_id
+        column = SQLITE_KEYED.get(section)
+        if column and key is not None:
+            ops.append((f"DELETE FROM {section} WHERE guild_id = ? AND {column} = ?", [(g, key)]))
+            value = self.data.get(section, {}).get(guild_id, {}).get(key)
+            if value is not None: ops.append((SQLITE_INSERT[section], sqlite_rows(section, g, key, value)))
+            return ops
+        ops.append((f"DELETE FROM {section} WHERE guild_id = ?", [(g,)]))
+        value = self.data.get(section, {}).get(guild_id)
+        if value is None: return ops
+        if column:
+            rows = []
+            for k, v in value.items(): rows += sqlite_rows(section, g, k, v)
+        else: rows = sqlite_rows(section, g, None, value)
+        ops.append((SQLITE_INSERT[section], rows))
+        return ops
+
+    async def _snapshot(self, pending):
+        return self._statements(pending[0])
+
+    def _statements(self, dirty):
+        if (None, None, None) in dirty:
+            dirty = {(section, None, None) for section in self.data}
+        ops = []
+        for section, guild_id, key in dirty:
+            ops += self._ops(section, guild_id, key)
+        return ops
+
+    def _write(self, ops):
+        with self.conn:
+            for sql, rows in ops: self.conn.executemany(sql, rows)
+
+    def _size(self, ops):
+        return "save_rows_total", sum(len(rows) for _, rows in ops)
+
+    async def put_shard_stats(self, rows):
+        async with self._lock: await asyncio.to_thread(self._put_shard_stats, rows)
+
+    def _put_shard_stats(self, rows):
+        with self.conn: self.conn.executemany("INSERT OR REPLACE INTO shard_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    async def shard_stats(self):
+        async with self._lock: return await asyncio.to_thread(lambda: self.conn.execute("SELECT * FROM shard_stats ORDER BY shard_id").fetchall())
+
+    def import_data(self, data):
+        self.data.clear()
+        self.data.update(data)
+        self._write(self._statements({(None, None, None)}))
+
+    async def close(self):
+        await super().close()
+        self.conn.close()
+
+def migrate_json_to_sqlite(json_path=DATA_FILE, sqlite_path=SQLITE_FILE):
+    store = SqliteStore(sqlite_path)
+    store.import_data(load_data(json_path))
+    store.conn.close()
+
+# Per-guild backups are gzip'd NDJSON: a header line, one line per record and an end line
+# with the record count. Per-user sections get one record per key so neither side ever
+# holds a whole guild's slice as a single JSON document.
+BACKUP_FORMAT = "invitebot-backup"
+BACKUP_PER_KEY = {"invited_by", "invite_history", "real_invites", "fake_invite_counts", "rewards_config", "personal_links"}
+BACKUP_SKIP = {"invite_snapshots", "resync_cursor", "pending_joins"}
+
+def is_int(value, low=0, high=None):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= low and (high is None or value <= high)
+
+def is_id(value):
+    # snowflakes are ints in memory and strings inside encoded records
+    return is_int(value, 1) or (isinstance(value, str) and value.isascii() and value.isdigit())
+
+def is_id_map(value, check):
+    return isinstance(value, dict) and all(is_id(k) and check(v) for k, v in value.items())
+
+def is_time(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < 10**11
+
+def is_campaign(c):
+    return (isinstance(c, dict) and isinstance(c.get("name"), str) and is_int(c.get("multiplier"), 1, MULTIPLIER_MAX)
+            and is_time(c.get("start")) and is_time(c.get("end")) and c.get("stack") in ("max", "add", "multiply"))
+
+# every section a backup may carry and what one record's value has to look like (per-user
+# sections one key at a time); anything else is rejected before the archive is loaded
+BACKUP_SCHEMA = {
+    "invited_by": lambda v: is_id(v) or (isinstance(v, dict) and is_id(v.get("inviter")) and is_int(v.get("points"))),
+    "invite_history": lambda v: isinstance(v, list) and all(map(is_id, v)),
+    "real_invites": is_int,
+    "fake_invite_counts": is_int,
+    "rewards_config": lambda v: is_int(v, 1),
+    "personal_links": lambda v: isinstance(v, str) and 0 < len(v) <= 100,
+    "log_channels": lambda v: is_int(v, 1),
+    "welcome_channels": lambda v: is_int(v, 1),
+    "multipliers": lambda v: is_int(v, 1),
+    "top_messages": lambda v: isinstance(v, dict) and is_int(v.get("channel"), 1) and is_int(v.get("message"), 1),
+    "campaigns": lambda v: is_id_map(v, is_campaign) and len(v) <= CAMPAIGN_LIMIT,
+    "campaign_points": lambda v: is_id_map(v, lambda points: is_id_map(points, is_int)),
+}
+
+def backup_records(data, guild_id, touched=None):
+    for section in list(data):
+        if section in BACKUP_SKIP: continue
+        changed = None if touched is None else {key for s, key in touched if s == section}
+        if changed is not None and not changed: continue
+        value = data[section].get(guild_id)
+        whole = changed is None or None in changed
+        if section not in BACKUP_PER_KEY or (value is None and whole):
+            if value is not None: yield {"s": section, "v": value}
+            elif touched is not None: yield {"s": section, "deleted": True}
+            continue
+        if whole:
+            yield {"s": section, "clear": True}
+            keys = list(value)
+        else: keys = list(changed)
+        for key in keys:
+            item = (value or {}).get(key)
+            if item is not None: yield {"s": section, "k": str(key), "v": item}
+            else: yield {"s": section, "k": str(key), "deleted": True}
+
+def encode_line(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=encode_record).encode("utf-8") + b"\n"
+
+async def write_backup(path, data, guild_id, touched=None, base=None):
+    # records are encoded on the loop a chunk at a time (values can't change mid-record),
+    # compression and disk writes happen in a thread
+    records = backup_records(data, guild_id, touched)
+    header = {"type": BACKUP_FORMAT, "version": 1, "guild": str(guild_id), "mode": "full" if touched is None else "incremental", "created_at": time.time(), "base": base}
+    count = 0
+    with gzip.open(path, "wb") as archive:
+        await asyncio.to_thread(archive.write, encode_line(header))
+        while True:
+            chunk = list(itertools.islice(records, BACKUP_CHUNK))
+            if not chunk: break
+            count += len(chunk)
+            await asyncio.to_thread(archive.write, b"".join(encode_line(record) for record in chunk))
+        await asyncio.to_thread(archive.write, encode_line({"type": "end", "records": count}))
+    return count
+
+def backup_key(section, record):
+    if section not in BACKUP_PER_KEY: raise ValueError(f"หมวด {section} ไม่ได้เก็บแยกรายคน")
+    if not is_id(record["k"]): raise ValueError(f"คีย์ในหมวด {section} ไม่ถูกต้อง: {record['k']!r}")
+    return int(record["k"])
+
+def check_backup(path, guild_id=None):
+    # full validation pass before anything is loaded: header, every record, and the end count
+    header, end, count = None, None, 0
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            record = json.loads(line)
+            if not isinstance(record, dict): raise ValueError("ข้อมูลในไฟล์เสีย")
+            if header is None:
+                if record.get("type") != BACKUP_FORMAT or record.get("version") != 1: raise ValueError("ไม่ใช่ไฟล์ Backup ของบอทนี้")
+                if record.get("mode") not in ("full", "incremental") or not is_id(record.get("guild")): raise ValueError("หัวไฟล์ Backup ไม่ถูกต้อง")
+                if guild_id is not None and record.get("guild") != str(guild_id): raise ValueError("ไฟล์นี้เป็นของเซิร์ฟอื่น")
+                header = record
+                continue
+            if end is not None: raise ValueError("มีข้อมูลต่อท้ายหลังจบไฟล์")
+            if record.get("type") == "end":
+                end = record
+                continue
+            section = record.get("s")
+            valid = BACKUP_SCHEMA.get(section) if isinstance(section, str) else None
+            if valid is None: raise ValueError(f"หมวดข้อมูลไม่ถูกต้อง: {section!r}")
+            if "k" in record:
+                backup_key(section, record)
+                ok = record.get("deleted") or valid(record.get("v"))
+            # per-user sections never carry a whole guild's value, only a clear before their keys
+            elif section in BACKUP_PER_KEY: ok = record.get("clear") or record.get("deleted")
+            else: ok = record.get("deleted") or valid(record.get("v"))
+            if not ok: raise ValueError(f"ข้อมูลหมวด {section} เสีย")
+            count += 1
+    if header is None: raise ValueError("ไฟล์ว่างเปล่า")
+    if end is None or end.get("records") != count: raise ValueError("ไฟล์ไม่ครบ (อาจถูกตัดกลางทาง)")
+    return header, count
+
+def apply_backup_record(store, guild_id, record, ids, cleared):
+    section = record["s"]
+    guilds = store.data.setdefault(section, {})
+    if "k" not in record:
+        if record.get("clear"):
+            guilds[guild_id] = {}
+            cleared.add(section)
+        elif record.get("deleted"): guilds.pop(guild_id, None)
+        else: guilds[guild_id] = normalize_section(section, record["v"], ids)
+        store.mark_dirty(section, guild_id)
+        return
+    key = ids[backup_key(section, record)]
+    values = guilds.setdefault(guild_id, {})
+    if record.get("deleted"): values.pop(key, None)
+    else: values[key] = normalize_section(section, {key: record["v"]}, ids)[key]
+    # a cleared section is already marked dirty as a whole
+    if section not in cleared: store.mark_dirty(section, guild_id, key)
+
+async def restore_backup(path, store, guild_id, header):
+    # call check_backup first; lines are read and parsed in a thread a chunk at a time
+    if header["mode"] == "full":
+        for section in list(store.data):
+            if section not in BACKUP_SKIP and store.data[section].pop(guild_id, None) is not None: store.mark_dirty(section, guild_id)
+    ids, cleared = IdInterner(), set()
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        lines = iter(archive)
+        next(lines)
+        while True:
+            chunk = await asyncio.to_thread(lambda: [json.loads(line) for line in itertools.islice(lines, BACKUP_CHUNK)])
+            if not chunk: break
+            for record in chunk:
+                if record.get("type") != "end": apply_backup_record(store, guild_id, record, ids, cleared)
+            await asyncio.sleep(0)
+
+def shard_scope(column, shards):
+    if not shards: return ""
+    count, shard_ids = shards
+    return f" AND ({column} >> 22) % {int(count)} IN ({','.join(str(int(i)) for i in shard_ids)})"
+
+# offline commands that write the store; they'd overwrite (or be overwritten by) a live bot's writes
+OFFLINE_WRITE = sys.argv[1:2] in (["restore"], ["migrate"]) or (sys.argv[1:2] == ["audit"] and "--fix" in sys.argv)
+
+def store_path():
+    # the file this process writes: migrate writes the SQLite file whatever the engine
+    if sys.argv[1:2] == ["migrate"]: return sys.argv[3] if len(sys.argv) > 3 else SQLITE_FILE
+    return SQLITE_FILE if STORAGE_ENGINE == "sqlite" else DATA_FILE
+
+def lock_store(exclusive):
+    # every process that loads the store holds a shared flock next to it before loading it, the
+    # offline writers hold it exclusively: so they refuse to run next to a running bot (any worker
+    # of a sharded one too) and a bot refuses to start while they run
+    if fcntl is None: return None
+    f = open(f"{store_path()}.lock", "a")
+    try: fcntl.flock(f, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        if exclusive: sys.exit("❌ บอท (หรือคำสั่งอื่น) ยังใช้ข้อมูลชุดนี้อยู่ ต้องปิดบอทก่อนค่อยรันคำสั่งนี้")
+        sys.exit("❌ มีคำสั่ง migrate / restore / audit --fix กำลังแก้ข้อมูลอยู่ รอให้เสร็จก่อนค่อยเปิดบอท")
+    return f
+
+def open_store():
+    if STORAGE_ENGINE == "sqlite":
+        if not os.path.exists(SQLITE_FILE) and os.path.exists(DATA_FILE):
+            migrate_json_to_sqlite()
+            print(f"📦 ย้ายข้อมูลจาก {DATA_FILE} ไปที่ {SQLITE_FILE} เรียบร้อยแล้ว")
+        return SqliteStore(SQLITE_FILE, shards=(SHARD_COUNT, SHARD_IDS) if SHARD_IDS else None)
+    return DataStore(load_data())
 
 intents = discord.Intents.default()
 intents.members = True
@@ -51,7 +724,536 @@ intents.invites = True
 intents.message_content = True
 
 MIN_ACCOUNT_AGE_DAYS = 3
+JOIN_BATCH_WINDOW = float(os.getenv("JOIN_BATCH_WINDOW", 0.5))
+PENDING_JOINS_LIMIT = int(os.getenv("PENDING_JOINS_LIMIT", 5000))
+AMBIGUOUS_HOLD = float(os.getenv("AMBIGUOUS_HOLD", 10))
+LEADERBOARD_INTERVAL = float(os.getenv("LEADERBOARD_INTERVAL", 10))
+NOTIFY_QUEUE_LIMIT = int(os.getenv("NOTIFY_QUEUE_LIMIT", 200))
+PRIORITY_MOD, PRIORITY_LOG, PRIORITY_WELCOME = 0, 1, 2
+AUDIT_CHUNK = int(os.getenv("AUDIT_CHUNK", 1000))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 8))
+RESYNC_BATCH = int(os.getenv("RESYNC_BATCH", 50))
+RESYNC_DELAY = float(os.getenv("RESYNC_DELAY", 1))
+PRUNE_BATCH = int(os.getenv("PRUNE_BATCH", 25))
+PRUNE_DELAY = float(os.getenv("PRUNE_DELAY", 1))
+RAID_WINDOW = float(os.getenv("RAID_WINDOW", 10))
+RAID_THRESHOLD = int(os.getenv("RAID_THRESHOLD", 30))
+RAID_KICK_CONCURRENCY = int(os.getenv("RAID_KICK_CONCURRENCY", 4))
 MILESTONES = [50, 100, 150, 200, 300, 500, 1000]
+CAMPAIGN_HISTORY = 10
+CAMPAIGN_LIMIT = 25
+MULTIPLIER_MAX = 100
+
+class CachedInvite:
+    __slots__ = ("uses", "inviter_id")
+
+    def __init__(self, uses, inviter_id):
+        self.uses = uses
+        self.inviter_id = inviter_id
+
+def index_invites(invites):
+    return {invite.code: CachedInvite(invite.uses or 0, invite.inviter.id if invite.inviter else None) for invite in invites}
+
+def invite_deltas(cache, new_invites, owners=None):
+    # one pass over the fresh list; only codes whose use count went up are kept.
+    # `owners` maps the bot's personal links to the member who asked for them.
+    owners = owners or {}
+    deltas = []
+    for invite in new_invites:
+        cached = cache.get(invite.code)
+        delta = (invite.uses or 0) - (cached.uses if cached else 0)
+        inviter_id = owners.get(invite.code) or (invite.inviter.id if invite.inviter else None)
+        if delta > 0 and inviter_id: deltas.append((invite.code, inviter_id, delta))
+    deltas.sort()
+    return deltas
+
+def split_deltas(members, deltas):
+    # Returns (assigned, pending). Use counts only say how often each link was used, not
+    # by whom, so a batch is credited only when every used link belongs to one inviter;
+    # anything else is pending instead of guessed.
+    total = sum(delta for _, _, delta in deltas)
+    if total == 0: return [], []
+    inviters = {inviter_id for _, inviter_id, _ in deltas}
+    if len(inviters) == 1 and total >= len(members):
+        inviter_id = inviters.pop()
+        return [(member, inviter_id) for member in members], []
+    return [], list(members)
+
+class JoinAttributor:
+    # One worker per guild: joins that land within `window` seconds of the last
+    # guild.invites() fetch share the next one and are attributed together. A join after a
+    # quiet spell is fetched right away, so it gets a batch of its own. After a batch that
+    # couldn't be split the guild skips the window for `hold` seconds, so each fetch only
+    # covers the joins of one round trip and fewer of them end up pending.
+    def __init__(self, bot, window=JOIN_BATCH_WINDOW, hold=AMBIGUOUS_HOLD):
+        self.bot = bot
+        self.window = window
+        self.hold = hold
+        self.queues = {}
+        self.workers = {}
+        self.last_fetch = {}
+        self.eager_until = {}
+        self.joins = 0
+        self.fetches = 0
+
+    def submit(self, member):
+        self.joins += 1
+        self.queues.setdefault(member.guild.id, []).append(member)
+        if member.guild.id not in self.workers:
+            self.workers[member.guild.id] = asyncio.create_task(self._work(member.guild))
+
+    async def _work(self, guild):
+        try:
+            await self.bot.warm_event(guild.id).wait()
+            while self.queues.get(guild.id):
+                now = time.monotonic()
+                wait = self.last_fetch.get(guild.id, 0) + self.window - now
+                if wait > 0 and now >= self.eager_until.get(guild.id, 0): await asyncio.sleep(wait)
+                try: await self._attribute(guild)
+                except Exception as e:
+                    self.queues.pop(guild.id, None)
+                    print(f"❌ คำนวณคนชวนไม่สำเร็จ ({guild.id}): {e!r}")
+        finally:
+            self.workers.pop(guild.id, None)
+
+    async def _attribute(self, guild):
+        cache = self.bot.invites_cache.get(guild.id)
+        if cache is None:
+            self.queues.pop(guild.id, None)
+            return
+        self.last_fetch[guild.id] = time.monotonic()
+        try: new_invites = await guild.invites()
+        except discord.Forbidden:
+            self.queues.pop(guild.id, None)
+            return
+        # taken after the fetch: joins that arrived while it was in flight are already in its use counts
+        batch = self.queues.pop(guild.id, [])
+        self.fetches += 1
+        metrics.inc("invite_fetches_total", source="join")
+        owners = {code: user_id for user_id, code in self.bot.db.get("personal_links", {}).get(guild.id, {}).items()}
+        deltas = invite_deltas(cache, new_invites, owners)
+        self.bot.set_invites(guild.id, new_invites)
+
+        assigned, pending = split_deltas(batch, deltas)
+        fakes = []
+        if pending:
+            self.eager_until[guild.id] = time.monotonic() + self.hold
+            # fake counts are per inviter, so a batch of young accounts only needs no split
+            if sum(delta for _, _, delta in deltas) == len(pending) and all(map(is_young_account, pending)): fakes, pending = pending, []
+        metrics.inc("joins_total", len(assigned) + len(fakes), result="attributed")
+        metrics.inc("joins_total", len(pending), result="pending")
+        metrics.inc("joins_total", len(batch) - len(assigned) - len(fakes) - len(pending), result="unattributed")
+        if fakes: await credit_fakes(guild, fakes, deltas)
+        if pending:
+            print(f"⚠️ ระบุคนชวนไม่ได้ {len(pending)} คนในเซิร์ฟ {guild.id} (ย้ายไปรายการรอตรวจสอบ)")
+            await hold_joins(guild, pending, sorted({inviter_id for _, inviter_id, _ in deltas}))
+        for member, inviter_id in assigned:
+            with metrics.timer("credit_seconds"): await credit_join(member, inviter_id)
+
+class RankIndex:
+    # Members sorted by (score desc, when they reached it) in one list, so a rank lookup is
+    # a bisect and top(k) a slice. An update moves one entry, and memory follows the number
+    # of members however high the scores go.
+    def __init__(self, scores=()):
+        self.seq = itertools.count()
+        self.entries = {}
+        for user_id, score in scores:
+            if score > 0: self.entries[user_id] = (-score, next(self.seq), user_id)
+        self.ranked = sorted(self.entries.values())
+
+    def __len__(self):
+        return len(self.ranked)
+
+    def set(self, user_id, score):
+        old = self.entries.pop(user_id, None)
+        if old is not None: del self.ranked[bisect.bisect_left(self.ranked, old)]
+        if score > 0:
+            entry = self.entries[user_id] = (-score, next(self.seq), user_id)
+            bisect.insort(self.ranked, entry)
+
+    def rank(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None: return None
+        return bisect.bisect_left(self.ranked, (entry[0],)) + 1
+
+    def top(self, k):
+        return [(user_id, -score) for score, _, user_id in self.ranked[:k]]
+
+class LeaderboardRenderer:
+    # Merges leaderboard refreshes per guild into at most one edit per `interval`,
+    # reuses the PartialMessage handle and skips edits that wouldn't change anything.
+    def __init__(self, bot, interval=LEADERBOARD_INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self.handles = {}
+        self.rendered = {}
+        self.last_edit = {}
+        self.tasks = {}
+        self.stats = {"requests": 0, "merged": 0, "skipped": 0, "edits": 0, "recreated": 0}
+
+    def count(self, result, amount=1):
+        self.stats[result] += amount
+        metrics.inc("leaderboard_updates_total", amount, result=result)
+
+    def request(self, guild):
+        self.count("requests")
+        if guild.id in self.tasks:
+            self.count("merged")
+            return
+        self.tasks[guild.id] = asyncio.create_task(self._run(guild))
+
+    async def _run(self, guild):
+        try:
+            wait = self.last_edit.get(guild.id, 0) + self.interval - time.monotonic()
+            if wait > 0: await asyncio.sleep(wait)
+        finally:
+            self.tasks.pop(guild.id, None)
+        try: await self.render(guild)
+        except discord.HTTPException as e: print(f"❌ อัปเดต Leaderboard ไม่สำเร็จ ({guild.id}): {e}")
+
+    def describe(self, guild_id):
+        sorted_invites = self.bot.ranking(guild_id).top(10)
+
+        desc = "🏆 **รายชื่อคนชวนเพื่อน 10 อันดับแรก**\n\n"
+        if not sorted_invites:
+            desc += "ยังไม่มีใครชวนเพื่อนมาเลย แย่งอันดับ 1 กันเร็ว! 🚀"
+        else:
+            medals = ["🥇", "🥈", "🥉"]
+            for i, (user_id, count) in enumerate(sorted_invites):
+                if count <= 0: continue
+                medal = medals[i] if i < 3 else "🏅"
+                desc += f"{medal} **อันดับ {i+1}:** <@{user_id}> ➔ `{count}` แต้ม\n"
+        for campaign_id in self.bot.campaigns.running(guild_id)[:3]:
+            c = self.bot.db["campaigns"][guild_id][campaign_id]
+            desc += f"\n🔥 **แคมเปญ {c['name']}** (x{c['multiplier']}, จบ <t:{int(c['end'])}:R>)\n" + self.bot.campaigns.describe(guild_id, campaign_id, 5) + "\n"
+        return desc
+
+    async def render(self, guild):
+        guild_id = guild.id
+        top_info = self.bot.db["top_messages"].get(guild_id)
+        if not top_info: return
+        channel = guild.get_channel(top_info["channel"])
+        if not channel: return
+
+        desc = self.describe(guild_id)
+        if self.rendered.get(guild.id) == (top_info["message"], desc):
+            self.count("skipped")
+            return
+        embed = discord.Embed(title="📊 Leaderboard: อันดับนักเชิญเพื่อน", description=desc, color=0xFFD700)
+
+        self.last_edit[guild.id] = time.monotonic()
+        handle = self.handles.get(guild.id)
+        if handle is None or handle.id != top_info["message"] or handle.channel.id != channel.id:
+            handle = self.handles[guild.id] = channel.get_partial_message(top_info["message"])
+        try:
+            await handle.edit(embed=embed)
+            self.count("edits")
+        except discord.NotFound:
+            new_msg = await channel.send(embed=embed)
+            self.handles[guild.id] = new_msg
+            top_info["message"] = new_msg.id
+            self.bot.store.mark_dirty("top_messages", guild_id)
+            self.count("recreated")
+        self.rendered[guild.id] = (top_info["message"], desc)
+
+class Notifier:
+    # Per-channel outbound queues drained by a background task: up to 10 embeds per
+    # message, moderation first, and when a queue is full the least important (newest)
+    # embed is dropped and summarized instead of growing without bound.
+    def __init__(self, limit=NOTIFY_QUEUE_LIMIT):
+        self.limit = limit
+        self.queues = {}
+        self.dropped = {}
+        self.tasks = {}
+        self.seq = itertools.count()
+        self.stats = {"queued": 0, "messages": 0, "embeds": 0, "dropped": 0, "rate_limited": 0}
+
+    def count(self, result, amount=1):
+        self.stats[result] += amount
+        metrics.inc("notifications_total", amount, result=result)
+
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def send(self, channel, embed, priority=PRIORITY_LOG):
+        self.count("queued")
+        queue = self.queues.setdefault(channel.id, [])
+        heapq.heappush(queue, (priority, next(self.seq), embed))
+        if len(queue) > self.limit:
+            queue.remove(max(queue))
+            heapq.heapify(queue)
+            self.dropped[channel.id] = self.dropped.get(channel.id, 0) + 1
+            self.count("dropped")
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = asyncio.create_task(self._drain(channel))
+
+    async def _drain(self, channel):
+        try:
+            while self.queues.get(channel.id):
+                queue = self.queues[channel.id]
+                dropped = self.dropped.pop(channel.id, 0)
+                batch = [heapq.heappop(queue) for _ in range(min(9 if dropped else 10, len(queue)))]
+                embeds = [embed for _, _, embed in batch]
+                if dropped:
+                    embeds.append(discord.Embed(description=f"⚠️ ข้ามการแจ้งเตือนไป **{dropped}** รายการ เพราะมีแจ้งเตือนเข้ามาเยอะเกินไป", color=0x95A5A6))
+                try:
+                    await channel.send(embeds=embeds)
+                    self.count("messages")
+                    self.count("embeds", len(embeds))
+                except (discord.RateLimited, discord.HTTPException) as e:
+                    retry_after = getattr(e, "retry_after", None)
+                    if not isinstance(e, discord.RateLimited) and e.status != 429:
+                        print(f"❌ ส่งแจ้งเตือนไปห้อง {channel.id} ไม่สำเร็จ: {e}")
+                        if isinstance(e, (discord.Forbidden, discord.NotFound)): self.queues.pop(channel.id, None)
+                        continue
+                    self.count("rate_limited")
+                    for item in batch: heapq.heappush(queue, item)
+                    if dropped: self.dropped[channel.id] = self.dropped.get(channel.id, 0) + dropped
+                    await asyncio.sleep(retry_after or 5)
+        finally:
+            self.tasks.pop(channel.id, None)
+            if not self.queues.get(channel.id): self.queues.pop(channel.id, None)
+
+class Raid:
+    __slots__ = ("guild", "started", "joins", "screened", "kicking", "kicked", "failed", "fakes", "held", "welcomes")
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.started = time.monotonic()
+        self.joins = 0
+        self.screened = set()
+        self.kicking = 0
+        self.kicked = 0
+        self.failed = 0
+        self.fakes = collections.Counter()
+        self.held = 0
+        self.welcomes = []
+
+class RaidGuard:
+    # Sliding window of join times per guild. At `threshold` joins within `window` seconds
+    # the guild is in raid mode until the rate falls under half of that: young accounts are
+    # kicked before any invite lookup, and per-member warnings, welcomes and leaderboard
+    # edits are held and folded into one summary when the raid ends.
+    def __init__(self, bot, window=RAID_WINDOW, threshold=RAID_THRESHOLD, concurrency=RAID_KICK_CONCURRENCY):
+        self.bot = bot
+        self.window = window
+        self.threshold = threshold
+        self.concurrency = concurrency
+        self.joins = {}
+        self.raids = {}
+        self.watchers = {}
+        self.kicks = collections.deque()
+        self.kick_workers = set()
+
+    def _trim(self, guild_id):
+        joins = self.joins.get(guild_id)
+        cutoff = time.monotonic() - self.window
+        while joins and joins[0] <= cutoff: joins.popleft()
+        return len(joins) if joins else 0
+
+    def record(self, guild):
+        self.joins.setdefault(guild.id, collections.deque()).append(time.monotonic())
+        rate = self._trim(guild.id)
+        raid = self.raids.get(guild.id)
+        if raid is None and rate >= self.threshold:
+            raid = self.raids[guild.id] = Raid(guild)
+            self.watchers[guild.id] = asyncio.create_task(self._watch(guild, raid))
+            metrics.inc("raids_total")
+            print(f"🛡️ เปิดโหมดกันเรดในเซิร์ฟ {guild.id} ({rate} คนใน {self.window:g} วินาที)")
+            log_ch = self.log_channel(guild)
+            if log_ch:
+                self.bot.notifier.send(log_ch, discord.Embed(
+                    title="🛡️ เปิดโหมดกันเรด!",
+                    description=f"มีคนเข้าเซิร์ฟ **{rate}** คนใน {self.window:g} วินาที\nบอทจะเตะไอดีอายุไม่ถึง {MIN_ACCOUNT_AGE_DAYS} วันทันที และพักข้อความต้อนรับกับ Leaderboard ไว้จนกว่าคนเข้าจะน้อยลง",
+                    color=0xE67E22
+                ), PRIORITY_MOD)
+        if raid: raid.joins += 1
+        return raid
+
+    def log_channel(self, guild):
+        log_ch_id = self.bot.db["log_channels"].get(guild.id)
+        return guild.get_channel(log_ch_id) if log_ch_id else None
+
+    def screen(self, member):
+        raid = self.raids[member.guild.id]
+        raid.screened.add(member.id)
+        raid.kicking += 1
+        self.kicks.append((member, raid))
+        if len(self.kick_workers) < self.concurrency:
+            worker = asyncio.create_task(self._kick_worker())
+            self.kick_workers.add(worker)
+            worker.add_done_callback(self.kick_workers.discard)
+
+    async def _kick_worker(self):
+        while self.kicks:
+            member, raid = self.kicks.popleft()
+            try:
+                await member.kick(reason=f"Auto-Mod: บัญชีอายุไม่ถึง {MIN_ACCOUNT_AGE_DAYS} วัน ระหว่างโหมดกันเรด")
+                raid.kicked += 1
+                metrics.inc("raid_kicks_total", result="kicked")
+            except discord.HTTPException:
+                raid.failed += 1
+                metrics.inc("raid_kicks_total", result="failed")
+            finally:
+                raid.kicking -= 1
+
+    async def _watch(self, guild, raid):
+        # stays on until the rate drops and every screened join has been kicked and attributed
+        try:
+            while True:
+                await asyncio.sleep(self.window / 5)
+                if self._trim(guild.id) < self.threshold / 2 and not raid.kicking and guild.id not in self.bot.attributor.workers: break
+        finally:
+            self.raids.pop(guild.id, None)
+            self.watchers.pop(guild.id, None)
+        print(f"🛡️ ปิดโหมดกันเรดในเซิร์ฟ {guild.id} (เตะไป {raid.kicked} คน)")
+        self.summarize(raid)
+        self.bot.leaderboard.request(guild)
+
+    def summarize(self, raid):
+        guild = raid.guild
+        log_ch = self.log_channel(guild)
+        if log_ch:
+            desc = f"⏱️ นาน **{time.monotonic() - raid.started:.0f}** วินาที มีคนเข้า **{raid.joins}** คน\n👢 เตะไอดีไก่ไป **{raid.kicked}** คน"
+            if raid.failed: desc += f" (เตะไม่ได้อีก {raid.failed} คน เพราะบอทยศต่ำกว่า)"
+            if raid.fakes: desc += "\n🚨 คนที่เอาไอดีไก่เข้ามามากที่สุด: " + ", ".join(f"<@{user_id}> ({count})" for user_id, count in raid.fakes.most_common(5))
+            if raid.held: desc += f"\n❔ อีก **{raid.held}** คนระบุคนชวนไม่ได้ (เข้าหลายลิงก์พร้อมกัน) รอแอดมินเลือกคนชวนใน `/pending_joins`"
+            self.bot.notifier.send(log_ch, discord.Embed(title="🛡️ โหมดกันเรดจบแล้ว", description=desc, color=0x2ECC71), PRIORITY_MOD)
+        welcome_ch_id = self.bot.db["welcome_channels"].get(guild.id)
+        welcome_ch = guild.get_channel(welcome_ch_id) if welcome_ch_id and raid.welcomes else None
+        if welcome_ch:
+            desc = "ยินดีต้อนรับ " + ", ".join(f"<@{member_id}>" for member_id in raid.welcomes[:20])
+            if len(raid.welcomes) > 20: desc += f" ...และอีก {len(raid.welcomes) - 20} คน"
+            self.bot.notifier.send(welcome_ch, discord.Embed(title=f"👋 ยินดีต้อนรับสมาชิกใหม่ {len(raid.welcomes)} คน", description=desc, color=0x3498DB), PRIORITY_WELCOME)
+
+def combine_multipliers(base, campaigns):
+    # "max" campaigns raise the floor, "add" ones add their extra over x1, "multiply" ones
+    # compound; the result is capped like a single multiplier
+    multiplier = max([base] + [c["multiplier"] for c in campaigns if c["stack"] == "max"])
+    multiplier += sum(c["multiplier"] - 1 for c in campaigns if c["stack"] == "add")
+    for c in campaigns:
+        if c["stack"] == "multiply": multiplier *= c["multiplier"]
+    return min(multiplier, MULTIPLIER_MAX)
+
+class CampaignScheduler:
+    # Campaign start/end times sit in a min-heap; one task sleeps until the earliest (or until
+    # a new campaign wakes it) and recomputes only that guild's cached multiplier, so joins
+    # read a cached number and an idle bot has nothing to do.
+    def __init__(self, bot):
+        self.bot = bot
+        self.heap = []
+        self.active = {}
+        self.wake = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        for guild_id in list(self.bot.db.setdefault("campaigns", {})): self.load(guild_id)
+        if self.task is None: self.task = asyncio.create_task(self._run())
+
+    def load(self, guild_id):
+        for campaign in self.bot.db.get("campaigns", {}).get(guild_id, {}).values(): self.schedule(guild_id, campaign)
+        self.refresh(guild_id)
+
+    def schedule(self, guild_id, campaign):
+        now = time.time()
+        for at in (campaign["start"], campaign["end"]):
+            if at > now: heapq.heappush(self.heap, (at, guild_id))
+        self.wake.set()
+
+    def refresh(self, guild_id):
+        now = time.time()
+        campaigns = self.bot.db.get("campaigns", {}).get(guild_id, {})
+        running = [campaign_id for campaign_id, c in campaigns.items() if c["start"] <= now < c["end"]]
+        base = self.bot.db.get("multipliers", {}).get(guild_id, 1)
+        self.active[guild_id] = (combine_multipliers(base, [campaigns[i] for i in running]), running)
+        return self.active[guild_id]
+
+    def multiplier(self, guild_id):
+        return (self.active.get(guild_id) or self.refresh(guild_id))[0]
+
+    def running(self, guild_id):
+        return (self.active.get(guild_id) or self.refresh(guild_id))[1]
+
+    async def _run(self):
+        while True:
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try: await asyncio.wait_for(self.wake.wait(), delay)
+                except asyncio.TimeoutError: pass
+            self.wake.clear()
+            due, now = set(), time.time()
+            while self.heap and self.heap[0][0] <= now: due.add(heapq.heappop(self.heap)[1])
+            for guild_id in due: self.boundary(guild_id)
+
+    def boundary(self, guild_id):
+        before = set(self.running(guild_id))
+        after = self.refresh(guild_id)[1]
+        guild = self.bot.get_guild(guild_id)
+        if guild is None or set(after) == before: return
+        log_ch_id = self.bot.db["log_channels"].get(guild_id)
+        log_ch = guild.get_channel(log_ch_id) if log_ch_id else None
+        campaigns = self.bot.db["campaigns"][guild_id]
+        if log_ch:
+            for campaign_id in after:
+                if campaign_id in before: continue
+                c = campaigns[campaign_id]
+                self.bot.notifier.send(log_ch, discord.Embed(title=f"🔥 เริ่มแคมเปญ {c['name']} แล้ว!", description=f"ชวนเพื่อนตอนนี้ได้แต้ม **x{self.multiplier(guild_id)}** จนถึง <t:{int(c['end'])}:f> (<t:{int(c['end'])}:R>)", color=0xE67E22))
+            for campaign_id in before - set(after):
+                if campaign_id in campaigns: self.bot.notifier.send(log_ch, self.results(guild_id, campaign_id, "🏁 แคมเปญจบแล้ว"))
+        if guild_id not in self.bot.raid.raids: self.bot.leaderboard.request(guild)
+
+    def credit(self, guild_id, user_id, points, joined_at=None):
+        # only campaigns that were already running when the member joined, so a leave
+        # takes back exactly what the join gave
+        running = self.running(guild_id)
+        if not running: return
+        campaigns = self.bot.db["campaigns"][guild_id]
+        at = joined_at.timestamp() if joined_at else time.time()
+        totals = self.bot.db.setdefault("campaign_points", {}).setdefault(guild_id, {})
+        for campaign_id in running:
+            if campaigns[campaign_id]["start"] > at: continue
+            points_by_user = totals.setdefault(campaign_id, {})
+            points_by_user[user_id] = max(0, points_by_user.get(user_id, 0) + points)
+        self.bot.store.mark_dirty("campaign_points", guild_id)
+
+    def top(self, guild_id, campaign_id, k=10):
+        points = self.bot.db.get("campaign_points", {}).get(guild_id, {}).get(campaign_id, {})
+        return [(user_id, p) for p, user_id in heapq.nlargest(k, ((p, user_id) for user_id, p in points.items() if p > 0))]
+
+    def describe(self, guild_id, campaign_id, k=10):
+        medals = ["🥇", "🥈", "🥉"]
+        lines = [f"{medals[i] if i < 3 else '🏅'} <@{user_id}> ➔ `{p}` แต้ม" for i, (user_id, p) in enumerate(self.top(guild_id, campaign_id, k))]
+        return "\n".join(lines) if lines else "ยังไม่มีใครได้แต้มในแคมเปญนี้"
+
+    def results(self, guild_id, campaign_id, title):
+        c = self.bot.db["campaigns"][guild_id][campaign_id]
+        return discord.Embed(title=f"{title}: {c['name']}", description=f"แต้มที่ได้ระหว่างแคมเปญ (x{c['multiplier']})\n\n" + self.describe(guild_id, campaign_id), color=0xFFD700)
+
+    def prune(self, guild_id):
+        # keeps the newest CAMPAIGN_HISTORY finished campaigns (and their totals) for /campaign_list
+        campaigns = self.bot.db["campaigns"].get(guild_id, {})
+        finished = sorted((c["end"], campaign_id) for campaign_id, c in campaigns.items() if c["end"] <= time.time())
+        for _, campaign_id in finished[:-CAMPAIGN_HISTORY]:
+            del campaigns[campaign_id]
+            self.bot.db.get("campaign_points", {}).get(guild_id, {}).pop(campaign_id, None)
+        if finished[:-CAMPAIGN_HISTORY]:
+            self.bot.store.mark_dirty("campaigns", guild_id)
+            self.bot.store.mark_dirty("campaign_points", guild_id)
+
+class RewardTiers:
+    __slots__ = ("thresholds", "role_ids")
+
+    def __init__(self, config):
+        tiers = sorted(config.items())
+        self.thresholds = [points for points, _ in tiers]
+        self.role_ids = [role_id for _, role_id in tiers]
+
+    def crossed(self, before, after):
+        lo, hi = bisect.bisect_right(self.thresholds, before), bisect.bisect_right(self.thresholds, after)
+        return list(zip(self.thresholds[lo:hi], self.role_ids[lo:hi]))
+
+    def earned(self, points):
+        return self.role_ids[:bisect.bisect_right(self.thresholds, points)]
 
 class EventView(discord.ui.View):
     def __init__(self, bot):
@@ -60,49 +1262,213 @@ class EventView(discord.ui.View):
 
     @discord.ui.button(label="เช็คสถิติ", style=discord.ButtonStyle.primary, custom_id="btn_check_stats", emoji="📊")
     async def check_stats(self, interaction: discord.Interaction, button: discord.ui.Button):
-        guild_id = str(interaction.guild.id)
-        user_id = str(interaction.user.id)
+        guild_id = interaction.guild.id
+        user_id = interaction.user.id
         invites = self.bot.db["real_invites"].get(guild_id, {}).get(user_id, 0)
+        ranking = self.bot.ranking(guild_id)
+        rank = ranking.rank(user_id)
         embed = discord.Embed(
             title="📊 สถิติการเชิญของคุณ",
-            description=f"ตอนนี้คุณมีแต้มสะสมทั้งหมด **{invites}** แต้ม 🚀",
+            description=f"ตอนนี้คุณมีแต้มสะสมทั้งหมด **{invites}** แต้ม 🚀\n" + (f"🏆 อันดับของคุณ: **#{rank}** จาก {len(ranking)} คน" if rank else "🏆 ยังไม่ติดอันดับ ชวนเพื่อนคนแรกเลย!"),
             color=0x3498DB
         )
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @discord.ui.button(label="ขอลิงก์เชิญ", style=discord.ButtonStyle.success, custom_id="btn_get_link", emoji="🔗")
     async def get_link(self, interaction: discord.Interaction, button: discord.ui.Button):
-        invite = await interaction.channel.create_invite(max_age=0, max_uses=0, reason="ขอลิงก์กิจกรรมจากบอท")
-        await interaction.response.send_message(f"นี่ลิงก์ส่วนตัวของคุณ ก๊อปไปชวนเพื่อนได้เลย\n👉 {invite.url}", ephemeral=True)
+        guild_id, user_id = interaction.guild.id, interaction.user.id
+        links = self.bot.db.setdefault("personal_links", {}).setdefault(guild_id, {})
+        code = links.get(user_id)
+        if code is None or code not in self.bot.invites_cache.get(guild_id, {}):
+            invite = await interaction.channel.create_invite(max_age=0, max_uses=0, reason="ขอลิงก์กิจกรรมจากบอท")
+            code = links[user_id] = invite.code
+            self.bot.store.mark_dirty("personal_links", guild_id, user_id)
+            self.bot.patch_invite(guild_id, invite.code, CachedInvite(invite.uses or 0, invite.inviter.id if invite.inviter else None))
+        await interaction.response.send_message(f"นี่ลิงก์ส่วนตัวของคุณ ก๊อปไปชวนเพื่อนได้เลย\n👉 https://discord.gg/{code}", ephemeral=True)
 
-class InviteBot(commands.Bot):
+class InviteBot(commands.AutoShardedBot):
     def __init__(self):
-        super().__init__(command_prefix="!", intents=intents)
-        self.invites_cache = {}
-        self.db = load_data()
+        super().__init__(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+        self.store_lock = lock_store(OFFLINE_WRITE)
+        self.store = open_store()
+        self.db = self.store.data
+        # last known use counts, so the first join after a restart still has something to diff against
+        self.invites_cache = {
+            guild_id: {code: CachedInvite(uses, inviter_id) for code, (uses, inviter_id) in snapshot.items()}
+            for guild_id, snapshot in self.db.setdefault("invite_snapshots", {}).items()
+        }
+        self.warm_events = {}
+        self.warmup_times = {}
+        self.warmup_semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+        self.rankings = {}
+        self.tiers = {}
+        self.resync_tasks = {}
+        self.prune_tasks = {}
+        self.last_backups = {}
+        self.restoring = set()
+        self.http_runner = None
+        self.lag_monitor = None
+        self.leaderboard = LeaderboardRenderer(self)
+        self.notifier = Notifier()
+        self.attributor = JoinAttributor(self)
+        self.raid = RaidGuard(self)
+        self.campaigns = CampaignScheduler(self)
 
     async def setup_hook(self):
+        # hosts stop the bot with SIGTERM, which would exit without close(); cancelling the main
+        # task instead unwinds through bot.run's cleanup like Ctrl-C does, so the store is flushed
+        with contextlib.suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        self.store.start()
+        self.campaigns.start()
+        self.http_runner = await start_http_server(self)
+        self.lag_monitor = asyncio.create_task(monitor_loop_lag())
         self.add_view(EventView(self))
-        await self.tree.sync()
-        print("✅ ซิงค์คำสั่ง Slash Commands เรียบร้อยแล้ว!")
+        # commands are global, one worker syncing them is enough
+        if WORKER_ID == 0:
+            await self.tree.sync()
+            print("✅ ซิงค์คำสั่ง Slash Commands เรียบร้อยแล้ว!")
         self.update_status.start()
 
     @tasks.loop(seconds=15)
     async def update_status(self):
-        ram = psutil.virtual_memory()
-        guild = self.guilds[0] if self.guilds else None
-        mult = self.db.get("multipliers", {}).get(str(guild.id), 1) if guild else 1
-        
-        if mult > 1: status_msg = f"RAM: {ram.percent}%"
-        else: status_msg = f"RAM: {ram.percent}%"
+        load = await self.shard_load()
+        total = sum(row[3] for row in load if time.time() - row[7] < SHARD_STALE)
+        for shard_id in self.shards:
+            guild = next((g for g in self.guilds if g.shard_id == shard_id), None)
+            mult = self.campaigns.multiplier(guild.id) if guild else 1
             
-        activity = discord.Activity(type=discord.ActivityType.watching, name=status_msg)
-        await self.change_presence(activity=activity)
+            if mult > 1: status_msg = f"กิจกรรมคูณแต้ม x{mult} | /help"
+            else: status_msg = f"ชวนเพื่อนใน {total} เซิร์ฟ | /help"
+            if len(load) > 1: status_msg += f" | shard {shard_id}"
+                
+            activity = discord.Activity(type=discord.ActivityType.watching, name=status_msg)
+            await self.change_presence(activity=activity, shard_id=shard_id)
+
+    def local_shard_load(self):
+        # (shard_id, worker, pid, guilds, members, latency, queued_joins, updated_at), the shard_stats row layout
+        load = {}
+        for shard_id, shard in self.shards.items():
+            latency = shard.latency if shard.latency < float("inf") else None
+            load[shard_id] = [shard_id, WORKER_ID, os.getpid(), 0, 0, latency, 0, time.time()]
+        for guild in self.guilds:
+            row = load.get(guild.shard_id)
+            if row is None: continue
+            row[3] += 1
+            row[4] += guild.member_count or 0
+            row[6] += len(self.attributor.queues.get(guild.id, ()))
+        return [tuple(row) for row in load.values()]
+
+    async def shard_load(self):
+        # every worker's shards when sharded across processes, read back from the shared store
+        load = self.local_shard_load()
+        if not SHARD_IDS: return load
+        await self.store.put_shard_stats(load)
+        return await self.store.shard_stats()
+
+    def ranking(self, guild_id):
+        ranking = self.rankings.get(guild_id)
+        if ranking is None:
+            ranking = self.rankings[guild_id] = RankIndex(self.db["real_invites"].get(guild_id, {}).items())
+        return ranking
+
+    def set_points(self, guild_id, user_id, points):
+        self.db["real_invites"].setdefault(guild_id, {})[user_id] = points
+        self.store.mark_dirty("real_invites", guild_id, user_id)
+        self.ranking(guild_id).set(user_id, points)
+
+    def warm_event(self, guild_id):
+        event = self.warm_events.get(guild_id)
+        if event is None: event = self.warm_events[guild_id] = asyncio.Event()
+        return event
+
+    def set_invites(self, guild_id, invites):
+        self.invites_cache[guild_id] = index_invites(invites)
+        self.db["invite_snapshots"][guild_id] = {code: [c.uses, c.inviter_id] for code, c in self.invites_cache[guild_id].items()}
+        self.store.mark_dirty("invite_snapshots", guild_id)
+
+    def patch_invite(self, guild_id, code, cached):
+        cache = self.invites_cache.get(guild_id)
+        if cache is None: return
+        snapshot = self.db["invite_snapshots"].setdefault(guild_id, {})
+        if cached is None:
+            cache.pop(code, None)
+            snapshot.pop(code, None)
+        else:
+            cache[code] = cached
+            snapshot[code] = [cached.uses, cached.inviter_id]
+        self.store.mark_dirty("invite_snapshots", guild_id)
+
+    def reward_tiers(self, guild_id):
+        tiers = self.tiers.get(guild_id)
+        if tiers is None: tiers = self.tiers[guild_id] = RewardTiers(self.db["rewards_config"].get(guild_id, {}))
+        return tiers
 
     @update_status.before_loop
     async def before_update_status(self):
         await self.wait_until_ready()
 
+    def is_warm(self):
+        return all(self.warm_event(guild.id).is_set() for guild in self.guilds)
+
+    async def close(self):
+        for watcher in list(self.raid.watchers.values()): watcher.cancel()
+        await super().close()
+        await self.store.close()
+        if self.lag_monitor: self.lag_monitor.cancel()
+        if self.campaigns.task: self.campaigns.task.cancel()
+        if self.http_runner: await self.http_runner.cleanup()
+
+async def monitor_loop_lag(interval=0.5):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        metrics.loop_lag = lag
+        metrics.observe("event_loop_lag_seconds", lag)
+
+def collect_gauges(bot):
+    # an AutoShardedBot never sets bot.ws, the connections belong to its shards
+    shards = bot.shards
+    connected = bool(shards) and not bot.is_closed() and bot.is_ready() and not any(shard.is_closed() for shard in shards.values())
+    yield "gateway_connected", {}, int(connected)
+    if connected: yield "gateway_latency_seconds", {}, bot.latency
+    yield "guilds", {}, len(bot.guilds)
+    yield "guilds_warm", {}, sum(1 for guild in bot.guilds if bot.warm_event(guild.id).is_set())
+    yield "event_loop_lag_seconds_last", {}, metrics.loop_lag
+    for shard_id, shard in shards.items():
+        yield "shard_connected", {"shard": shard_id}, int(not shard.is_closed())
+        if shard.latency < float("inf"): yield "shard_latency_seconds", {"shard": shard_id}, shard.latency
+    yield "queue_depth", {"queue": "joins"}, sum(len(q) for q in bot.attributor.queues.values())
+    yield "queue_depth", {"queue": "pending_joins"}, sum(len(pending) for pending in bot.db.get("pending_joins", {}).values())
+    yield "queue_depth", {"queue": "notifications"}, bot.notifier.depth()
+    yield "queue_depth", {"queue": "raid_kicks"}, len(bot.raid.kicks)
+    yield "raids_active", {}, len(bot.raid.raids)
+    yield "campaigns_active", {}, sum(len(running) for _, running in bot.campaigns.active.values())
+    yield "queue_depth", {"queue": "store_changes"}, bot.store.changes
+
+async def start_http_server(bot):
+    async def home(request):
+        return web.Response(text="Bot is online and running!")
+
+    async def healthz(request):
+        return web.json_response({"ok": not bot.is_closed()}, status=200 if not bot.is_closed() else 503)
+
+    async def readyz(request):
+        ready = bot.is_ready() and not bot.is_closed() and bot.is_warm()
+        body = {"ready": ready, "guilds": len(bot.guilds), "latency_ms": round(bot.latency * 1000) if bot.is_ready() else None}
+        return web.json_response(body, status=200 if ready else 503)
+
+    async def metrics_page(request):
+        return web.Response(text=metrics.render(collect_gauges(bot)), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.add_routes([web.get("/", home), web.get("/healthz", healthz), web.get("/readyz", readyz), web.get("/metrics", metrics_page)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", HTTP_PORT).start()
+    return runner
+
 bot = InviteBot()
 
 @bot.tree.error
@@ -114,197 +1480,459 @@ async def on_app_command_error(interaction: discord.Interaction, error: app_comm
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
 async def update_leaderboard(guild):
-    guild_id = str(guild.id)
-    if guild_id not in bot.db["top_messages"]: return
-        
-    top_info = bot.db["top_messages"][guild_id]
-    channel = guild.get_channel(top_info["channel"])
-    if not channel: return
+    # held during a raid; the raid summary requests one refresh when it ends
+    if guild.id in bot.raid.raids: return
+    bot.leaderboard.request(guild)
 
-    invites_data = bot.db["real_invites"].get(guild_id, {})
-    sorted_invites = sorted(invites_data.items(), key=lambda x: x[1], reverse=True)[:10]
+@bot.event
+async def on_ready():
+    print(f'✅ ล็อกอินสำเร็จ! ใช้งานบอทในชื่อ {bot.user}')
+    started = time.perf_counter()
+    await asyncio.gather(*(warm_guild(guild, bot.warmup_semaphore) for guild in bot.guilds))
+    if bot.warmup_times:
+        slowest = max(bot.warmup_times, key=bot.warmup_times.get)
+        print(f"🔥 โหลดข้อมูลเชิญ {len(bot.guilds)} เซิร์ฟเสร็จใน {time.perf_counter() - started:.1f}s (ช้าสุด {slowest}: {bot.warmup_times[slowest]:.1f}s)")
 
-    desc = "🏆 **รายชื่อคนชวนเพื่อน 10 อันดับแรก**\n\n"
-    if not sorted_invites:
-        desc += "ยังไม่มีใครชวนเพื่อนมาเลย แย่งอันดับ 1 กันเร็ว! 🚀"
-    else:
-        medals = ["🥇", "🥈", "🥉"]
-        for i, (user_id, count) in enumerate(sorted_invites):
-            if count <= 0: continue
-            medal = medals[i] if i < 3 else "🏅"
-            desc += f"{medal} **อันดับ {i+1}:** <@{user_id}> ➔ `{count}` แต้ม\n"
+async def warm_guild(guild, semaphore):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            invites = await guild.invites()
+            metrics.inc("invite_fetches_total", source="warmup")
+            # joins queued before we got here are diffed against the saved snapshot instead
+            if not (bot.attributor.queues.get(guild.id) and guild.id in bot.invites_cache):
+                bot.set_invites(guild.id, invites)
+        except discord.Forbidden: pass
+        except discord.HTTPException as e: print(f"❌ โหลดลิงก์เชิญของเซิร์ฟ {guild.id} ไม่สำเร็จ: {e}")
+        bot.warmup_times[guild.id] = time.perf_counter() - started
+        metrics.observe("warmup_seconds", bot.warmup_times[guild.id])
+        bot.warm_event(guild.id).set()
+    await update_leaderboard(guild)
 
-    embed = discord.Embed(title="📊 Leaderboard: อันดับนักเชิญเพื่อน", description=desc, color=0xFFD700)
+# both also fire for every guild before on_ready, which warms them all at once
+@bot.event
+async def on_guild_join(guild):
+    if bot.is_ready(): await warm_guild(guild, bot.warmup_semaphore)
 
-    try:
-        msg = await channel.fetch_message(top_info["message"])
-        await msg.edit(embed=embed)
-    except:
-        new_msg = await channel.send(embed=embed)
-        bot.db["top_messages"][guild_id]["message"] = new_msg.id
-        save_data(bot.db)
+@bot.event
+async def on_guild_available(guild):
+    # back after an outage: invites may have changed meanwhile
+    if bot.is_ready(): await warm_guild(guild, bot.warmup_semaphore)
 
 @bot.event
-async def on_ready():
-    print(f'✅ ล็อกอินสำเร็จ! ใช้งานบอทในชื่อ {bot.user}')
-    for guild in bot.guilds:
-        try: bot.invites_cache[guild.id] = await guild.invites()
-        except discord.Forbidden: pass
-        await update_leaderboard(guild)
+async def on_guild_remove(guild):
+    # queued joins can't be attributed any more; setting the event lets their worker see
+    # the empty queue and exit instead of waiting forever
+    bot.attributor.queues.pop(guild.id, None)
+    event = bot.warm_events.pop(guild.id, None)
+    if event: event.set()
+    bot.warmup_times.pop(guild.id, None)
+    bot.invites_cache.pop(guild.id, None)
 
 @bot.event
-async def on_invite_create(invite): bot.invites_cache[invite.guild.id] = await invite.guild.invites()
+async def on_invite_create(invite):
+    bot.patch_invite(invite.guild.id, invite.code, CachedInvite(invite.uses or 0, invite.inviter.id if invite.inviter else None))
 
 @bot.event
-async def on_invite_delete(invite): bot.invites_cache[invite.guild.id] = await invite.guild.invites()
+async def on_invite_delete(invite):
+    bot.patch_invite(invite.guild.id, invite.code, None)
 
 @bot.event
 async def on_member_join(member):
+    with metrics.timer("event_seconds", event="member_join"):
+        raid = bot.raid.record(member.guild)
+        # still goes through attribution below, so when the inviter can be told their fake count goes up
+        if raid and is_young_account(member): bot.raid.screen(member)
+        if bot.warm_event(member.guild.id).is_set() and member.guild.id not in bot.invites_cache: return
+        bot.attributor.submit(member)
+
+def is_young_account(member):
+    return (discord.utils.utcnow() - member.created_at).days < MIN_ACCOUNT_AGE_DAYS
+
+def count_fake(guild_id, inviter_id, count=1):
+    counts = bot.db["fake_invite_counts"].setdefault(guild_id, {})
+    counts[inviter_id] = counts.get(inviter_id, 0) + count
+    bot.store.mark_dirty("fake_invite_counts", guild_id, inviter_id)
+    return counts[inviter_id]
+
+async def kick_fake(member):
+    try:
+        await member.kick(reason=f"Auto-Mod: บัญชีอายุไม่ถึง {MIN_ACCOUNT_AGE_DAYS} วัน (สงสัยว่าเป็นไอดีไก่)")
+        return True
+    except discord.Forbidden: return False
+
+async def credit_fakes(guild, members, deltas):
+    # A batch of young accounts only: whichever of them came through which link, each
+    # inviter's fake count goes up by the uses of their links.
+    raid = bot.raid.raids.get(guild.id)
+    kicked = 0
+    for member in members:
+        if raid and member.id in raid.screened: raid.screened.discard(member.id)
+        elif await kick_fake(member): kicked += 1
+    fakes = collections.Counter()
+    for _, inviter_id, delta in deltas: fakes[inviter_id] += delta
+    log_ch = bot.raid.log_channel(guild)
+    for inviter_id, count in fakes.items():
+        fake_count = count_fake(guild.id, inviter_id, count)
+        if raid: raid.fakes[inviter_id] += count
+        elif log_ch:
+            bot.notifier.send(log_ch, discord.Embed(
+                title="🚨 Auto-Mod: ตรวจพบคนพยายามปั๊มยอด!",
+                description=f"<@{inviter_id}> ชวนไอดีไก่เข้ามา **{count}** คน (มาพร้อมกับไอดีไก่จากลิงก์ของคนอื่น)\n⚠️ รวมเป็นครั้งที่ **{fake_count}** แล้วนะที่คนนี้เอาไอดีไก่เข้ามา\n**สถานะ:** 👢 เตะไอดีไก่ชุดนี้ไป {kicked}/{len(members)} คน",
+                color=0xE74C3C
+            ), PRIORITY_MOD)
+
+async def hold_joins(guild, members, candidates):
+    # Joins whose inviter can't be told apart wait in pending_joins for an admin to pick one
+    # of the candidates with /assign_join. Young accounts are still kicked right away, only
+    # their fake count waits.
+    guild_id = guild.id
+    pending = bot.db.setdefault("pending_joins", {}).setdefault(guild_id, {})
+    raid = bot.raid.raids.get(guild_id)
+    if raid: raid.held += len(members)
+    kicked = 0
+    for member in members:
+        young = is_young_account(member)
+        pending.pop(member.id, None)
+        pending[member.id] = {"candidates": candidates, "young": young, "at": int(time.time())}
+        bot.store.mark_dirty("pending_joins", guild_id, member.id)
+        if not young: continue
+        if raid and member.id in raid.screened: raid.screened.discard(member.id)
+        elif await kick_fake(member): kicked += 1
+    overflow = list(itertools.islice(pending, max(0, len(pending) - PENDING_JOINS_LIMIT)))
+    for member_id in overflow:
+        del pending[member_id]
+        bot.store.mark_dirty("pending_joins", guild_id, member_id)
+    if overflow:
+        metrics.inc("pending_joins_dropped_total", len(overflow))
+        print(f"⚠️ รายการรอตรวจของเซิร์ฟ {guild_id} เต็ม ({PENDING_JOINS_LIMIT}) ลบรายการเก่าสุดไป {len(overflow)} รายการ")
+    log_ch = bot.raid.log_channel(guild)
+    if log_ch and not raid:
+        shown = ", ".join(f"<@{inviter_id}>" for inviter_id in candidates[:5]) + (f" ...และอีก {len(candidates) - 5} คน" if len(candidates) > 5 else "")
+        desc = f"มีคนเข้า **{len(members)}** คนพร้อมกันผ่านลิงก์ของ {shown} บอทเลยไม่เดาว่าใครชวนใคร\nใช้ `/pending_joins` ดูรายชื่อ แล้ว `/assign_join` เลือกคนชวนให้ได้เลย"
+        if kicked: desc += f"\n👢 เตะไอดีไก่ในชุดนี้ไป {kicked} คน (ยอดไอดีไก่จะนับให้คนชวนตอนเลือกคนชวน)"
+        bot.notifier.send(log_ch, discord.Embed(title="❔ ระบุคนชวนไม่ได้", description=desc, color=0x95A5A6), PRIORITY_MOD)
+
+async def credit_join(member, inviter_id):
     guild = member.guild
-    guild_id = str(guild.id)
-    member_id = str(member.id)
+    guild_id = guild.id
+    member_id = member.id
+    inviter_mention = f"<@{inviter_id}>"
+    log_ch_id = bot.db["log_channels"].get(guild_id)
+    log_ch = guild.get_channel(log_ch_id) if log_ch_id else None
     
-    if guild.id not in bot.invites_cache: return
-    old_invites = bot.invites_cache[guild.id]
-    try:
-        new_invites = await guild.invites()
-        bot.invites_cache[guild.id] = new_invites
-    except discord.Forbidden: return
-
-    inviter = None
-    for invite in old_invites:
-        for new_invite in new_invites:
-            if invite.code == new_invite.code and invite.uses < new_invite.uses:
-                inviter = new_invite.inviter
-                break
-        if inviter: break
-
-    if inviter:
-        inviter_id = str(inviter.id)
-        log_ch_id = bot.db["log_channels"].get(guild_id)
-        log_ch = guild.get_channel(log_ch_id) if log_ch_id else None
-        
-        account_age = (discord.utils.utcnow() - member.created_at).days
-        is_fake = account_age < MIN_ACCOUNT_AGE_DAYS
+    raid = bot.raid.raids.get(guild_id)
+    
+    if is_young_account(member):
+        fake_count = count_fake(guild_id, inviter_id)
+        if raid and member_id in raid.screened:
+            # already kicked by the raid screen; reported in the raid summary instead
+            raid.screened.discard(member_id)
+            raid.fakes[inviter_id] += 1
+            return
         
-        if is_fake:
-            if guild_id not in bot.db["fake_invite_counts"]: bot.db["fake_invite_counts"][guild_id] = {}
-            fake_count = bot.db["fake_invite_counts"][guild_id].get(inviter_id, 0) + 1
-            bot.db["fake_invite_counts"][guild_id][inviter_id] = fake_count
-            save_data(bot.db)
-            
-            kicked = False
-            try:
-                await member.kick(reason=f"Auto-Mod: บัญชีอายุไม่ถึง {MIN_ACCOUNT_AGE_DAYS} วัน (สงสัยว่าเป็นไอดีไก่)")
-                kicked = True
-            except discord.Forbidden: pass
+        kicked = await kick_fake(member)
+
+        if log_ch:
+            warn_embed = discord.Embed(
+                title="🚨 Auto-Mod: ตรวจพบคนพยายามปั๊มยอด!",
+                description=f"{inviter_mention} ชวนไอดีไก่ {member.mention} เข้ามา\n⚠️ นี่คือครั้งที่ **{fake_count}** แล้วนะที่คนนี้เอาไอดีไก่เข้ามา\n**สถานะ:** {'👢 เตะไอดีไก่นี้ทิ้งเรียบร้อยแล้ว!' if kicked else '⚠️ บอทยศต่ำกว่า เลยเตะไม่ได้'}",
+                color=0xE74C3C
+            )
+            bot.notifier.send(log_ch, warn_embed, PRIORITY_MOD)
+        return
+      
+    base_multiplier = bot.campaigns.multiplier(guild_id)
+    points_to_add = 1 * base_multiplier
+    inviter_member = guild.get_member(inviter_id)
+    if inviter_member and inviter_member.premium_since is not None: 
+        points_to_add += 1
+
+    if guild_id not in bot.db["invited_by"]: bot.db["invited_by"][guild_id] = {}
+    if guild_id not in bot.db["invite_history"]: bot.db["invite_history"][guild_id] = {}
+    if inviter_id not in bot.db["invite_history"][guild_id]: bot.db["invite_history"][guild_id][inviter_id] = IdSet()
+    
+    bot.db["invite_history"][guild_id][inviter_id].add(member_id)
+    bot.db["invited_by"][guild_id][member_id] = Invitation(inviter_id, points_to_add)
+    
+    current_invites = bot.db["real_invites"].get(guild_id, {}).get(inviter_id, 0) + points_to_add
+    bot.set_points(guild_id, inviter_id, current_invites)
+    bot.campaigns.credit(guild_id, inviter_id, points_to_add, member.joined_at)
+    bot.store.mark_dirty("invite_history", guild_id, inviter_id)
+    bot.store.mark_dirty("invited_by", guild_id, member_id)
+
+    welcome_ch_id = bot.db["welcome_channels"].get(guild_id)
+    if raid: raid.welcomes.append(member_id)
+    elif welcome_ch_id:
+        welcome_ch = guild.get_channel(welcome_ch_id)
+        if welcome_ch:
+            wel_embed = discord.Embed(
+                title="👋 ยินดีต้อนรับสมาชิกใหม่",
+                description=f"คุณ {member.mention} เข้าร่วมเซิร์ฟเวอร์เราแล้ว!\n🎯 คนที่ชวนมาคือ: {inviter_mention}\n📈 ตอนนี้คนชวนมีแต้มสะสม **{current_invites}** แต้มแล้ว" + (f"\n*(ได้แต้มโบนัส x{points_to_add})*" if points_to_add > 1 else ""),
+                color=0x3498DB
+            )
+            if member.avatar: wel_embed.set_thumbnail(url=member.avatar.url)
+            bot.notifier.send(welcome_ch, wel_embed, PRIORITY_WELCOME)
 
+    crossed = bot.reward_tiers(guild_id).crossed(current_invites - points_to_add, current_invites)
+    member_to_reward = guild.get_member(inviter_id) if crossed else None
+    for req_points, role_id in crossed:
+        role = guild.get_role(role_id)
+        if role and member_to_reward:
+            await member_to_reward.add_roles(role)
             if log_ch:
-                warn_embed = discord.Embed(
-                    title="🚨 Auto-Mod: ตรวจพบคนพยายามปั๊มยอด!",
-                    description=f"{inviter.mention} ชวนไอดีไก่ {member.mention} เข้ามา\n⚠️ นี่คือครั้งที่ **{fake_count}** แล้วนะที่คนนี้เอาไอดีไก่เข้ามา\n**สถานะ:** {'👢 เตะไอดีไก่นี้ทิ้งเรียบร้อยแล้ว!' if kicked else '⚠️ บอทยศต่ำกว่า เลยเตะไม่ได้'}",
-                    color=0xE74C3C
-                )
-                await log_ch.send(embed=warn_embed)
-            return
-          
-        base_multiplier = bot.db.get("multipliers", {}).get(guild_id, 1)
-        points_to_add = 1 * base_multiplier
-        inviter_member = guild.get_member(inviter.id)
-        if inviter_member and inviter_member.premium_since is not None: 
-            points_to_add += 1
-
-        if guild_id not in bot.db["invited_by"]: bot.db["invited_by"][guild_id] = {}
-        if guild_id not in bot.db["real_invites"]: bot.db["real_invites"][guild_id] = {}
-        if guild_id not in bot.db["invite_history"]: bot.db["invite_history"][guild_id] = {}
-        if inviter_id not in bot.db["invite_history"][guild_id]: bot.db["invite_history"][guild_id][inviter_id] = []
-        
-        bot.db["invite_history"][guild_id][inviter_id].append(member_id)
-        bot.db["invited_by"][guild_id][member_id] = {"inviter": inviter_id, "points": points_to_add}
-        
-        current_invites = bot.db["real_invites"][guild_id].get(inviter_id, 0) + points_to_add
-        bot.db["real_invites"][guild_id][inviter_id] = current_invites
-        save_data(bot.db)
-
-        welcome_ch_id = bot.db["welcome_channels"].get(guild_id)
-        if welcome_ch_id:
-            welcome_ch = guild.get_channel(welcome_ch_id)
-            if welcome_ch:
-                wel_embed = discord.Embed(
-                    title="👋 ยินดีต้อนรับสมาชิกใหม่",
-                    description=f"คุณ {member.mention} เข้าร่วมเซิร์ฟเวอร์เราแล้ว!\n🎯 คนที่ชวนมาคือ: {inviter.mention}\n📈 ตอนนี้คนชวนมีแต้มสะสม **{current_invites}** แต้มแล้ว" + (f"\n*(ได้แต้มโบนัส x{points_to_add})*" if points_to_add > 1 else ""),
-                    color=0x3498DB
-                )
-                if member.avatar: wel_embed.set_thumbnail(url=member.avatar.url)
-                await welcome_ch.send(embed=wel_embed)
-
-        if guild_id in bot.db["rewards_config"]:
-            config = bot.db["rewards_config"][guild_id]
-            for req_invites_str, role_id in config.items():
-                req_points = int(req_invites_str)
-                if current_invites >= req_points and (current_invites - points_to_add) < req_points: 
-                    role = guild.get_role(role_id)
-                    member_to_reward = guild.get_member(inviter.id)
-                    if role and member_to_reward:
-                        await member_to_reward.add_roles(role)
-                        if log_ch:
-                            log_embed = discord.Embed(title="🎉 ปลดล็อคยศใหม่!", description=f"ยินดีด้วย {member_to_reward.mention}! คุณสะสมแต้มครบ **{req_points}** แต้มแล้ว รับยศ {role.mention} ไปประดับโปรไฟล์เลย!", color=0x2ECC71)
-                            await log_ch.send(embed=log_embed)
-
-        for ms in MILESTONES:
-            if current_invites >= ms and (current_invites - points_to_add) < ms and log_ch:
-                await log_ch.send(embed=discord.Embed(title="🔥 ทำลายสถิติใหม่!", description=f"ทุกคนปรบมือให้ {inviter.mention} หน่อย!\nตอนนี้ชวนเพื่อนทะลุ **{ms}** แต้ม 👑✨", color=0xFF00FF))
-
-        await update_leaderboard(guild)
+                log_embed = discord.Embed(title="🎉 ปลดล็อคยศใหม่!", description=f"ยินดีด้วย {member_to_reward.mention}! คุณสะสมแต้มครบ **{req_points}** แต้มแล้ว รับยศ {role.mention} ไปประดับโปรไฟล์เลย!", color=0x2ECC71)
+                bot.notifier.send(log_ch, log_embed)
+
+    for ms in MILESTONES:
+        if current_invites >= ms and (current_invites - points_to_add) < ms and log_ch:
+            bot.notifier.send(log_ch, discord.Embed(title="🔥 ทำลายสถิติใหม่!", description=f"ทุกคนปรบมือให้ {inviter_mention} หน่อย!\nตอนนี้ชวนเพื่อนทะลุ **{ms}** แต้ม 👑✨", color=0xFF00FF))
+
+    await update_leaderboard(guild)
 
 @bot.event
 async def on_member_remove(member):
-    guild = member.guild
-    guild_id = str(guild.id)
-    member_id = str(member.id)
+    with metrics.timer("event_seconds", event="member_remove"):
+        guild = member.guild
+        guild_id = guild.id
+        member_id = member.id
+
+        # nothing to credit once they're gone; a young account's entry stays for its fake count
+        pending = bot.db.get("pending_joins", {}).get(guild_id, {})
+        if member_id in pending and not pending[member_id]["young"]:
+            del pending[member_id]
+            bot.store.mark_dirty("pending_joins", guild_id, member_id)
     
-    if guild_id in bot.db["invited_by"] and member_id in bot.db["invited_by"][guild_id]:
-        data = bot.db["invited_by"][guild_id][member_id]
-        if isinstance(data, str): inviter_id, points = data, 1
-        else: inviter_id, points = data["inviter"], data["points"]
+        if guild_id in bot.db["invited_by"] and member_id in bot.db["invited_by"][guild_id]:
+            data = bot.db["invited_by"][guild_id][member_id]
+            inviter_id, points = data.inviter, data.points
         
-        if guild_id in bot.db["real_invites"] and inviter_id in bot.db["real_invites"][guild_id]:
-            bot.db["real_invites"][guild_id][inviter_id] = max(0, bot.db["real_invites"][guild_id][inviter_id] - points)
+            if guild_id in bot.db["real_invites"] and inviter_id in bot.db["real_invites"][guild_id]:
+                bot.set_points(guild_id, inviter_id, max(0, bot.db["real_invites"][guild_id][inviter_id] - points))
+            bot.campaigns.credit(guild_id, inviter_id, -points, member.joined_at)
                 
-        if inviter_id in bot.db.get("invite_history", {}).get(guild_id, {}):
-            if member_id in bot.db["invite_history"][guild_id][inviter_id]:
-                bot.db["invite_history"][guild_id][inviter_id].remove(member_id)
+            if inviter_id in bot.db.get("invite_history", {}).get(guild_id, {}):
+                bot.db["invite_history"][guild_id][inviter_id].discard(member_id)
                 
-        del bot.db["invited_by"][guild_id][member_id]
-        save_data(bot.db)
-        await update_leaderboard(guild)
+            del bot.db["invited_by"][guild_id][member_id]
+            bot.store.mark_dirty("invite_history", guild_id, inviter_id)
+            bot.store.mark_dirty("invited_by", guild_id, member_id)
+            await update_leaderboard(guild)
 
+async def iter_member_ids(guild):
+    if guild.chunked:
+        members = guild.members
+        for i in range(0, len(members), AUDIT_CHUNK):
+            yield [m.id for m in members[i:i + AUDIT_CHUNK]]
+            await asyncio.sleep(0)
+        return
+    chunk = []
+    async for member in guild.fetch_members(limit=None):
+        chunk.append(member.id)
+        if len(chunk) >= AUDIT_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
 
+async def audit_guild(guild, fix=False):
+    # Rebuilds real_invites and invite_history from invited_by in one pass. The db is
+    # snapshotted up front and fixes are applied as deltas, so joins and leaves that
+    # happen while the audit is yielding to the loop are kept.
+    guild_id = guild.id
+    invited_by = bot.db["invited_by"].setdefault(guild_id, {})
+    records = list(invited_by.items())
+    real_snapshot = dict(bot.db["real_invites"].get(guild_id, {}))
+    history_snapshot = {inviter_id: set(members) for inviter_id, members in bot.db["invite_history"].get(guild_id, {}).items()}
 
-@bot.tree.command(name="backup", description="ดึงไฟล์ข้อมูลบอทสำรอง")
+    present = set()
+    async for chunk in iter_member_ids(guild):
+        present.update(chunk)
+
+    totals, expected, departed = {}, {}, []
+    for i, (member_id, data) in enumerate(records):
+        if i % AUDIT_CHUNK == 0: await asyncio.sleep(0)
+        if member_id not in present:
+            departed.append((member_id, data))
+            continue
+        inviter_id, points = data.inviter, data.points
+        totals[inviter_id] = totals.get(inviter_id, 0) + points
+        expected.setdefault(inviter_id, []).append(member_id)
+
+    points_drift = {u: real_snapshot.get(u, 0) - totals.get(u, 0) for u in real_snapshot.keys() | totals.keys()}
+    points_drift = {u: d for u, d in points_drift.items() if d}
+    history_drift = {}
+    for inviter_id in history_snapshot.keys() | expected.keys():
+        want, have = set(expected.get(inviter_id, ())), history_snapshot.get(inviter_id, set())
+        if want != have: history_drift[inviter_id] = (have - want, [m for m in expected.get(inviter_id, ()) if m not in have])
+
+    report = {
+        "records": len(records),
+        "members": len(present),
+        "departed": len(departed),
+        "inviters_drifted": len(points_drift),
+        "points_drift": sum(abs(d) for d in points_drift.values()),
+        "history_drifted": len(history_drift),
+    }
+    if not fix: return report
+
+    for i, (member_id, data) in enumerate(departed):
+        if i % AUDIT_CHUNK == 0: await asyncio.sleep(0)
+        if invited_by.get(member_id) is data:
+            del invited_by[member_id]
+            bot.store.mark_dirty("invited_by", guild_id, member_id)
+    live_points = bot.db["real_invites"].setdefault(guild_id, {})
+    for inviter_id, drift in points_drift.items():
+        bot.set_points(guild_id, inviter_id, max(0, live_points.get(inviter_id, 0) - drift))
+    live_history = bot.db["invite_history"].setdefault(guild_id, {})
+    for inviter_id, (remove, add) in history_drift.items():
+        current = live_history.setdefault(inviter_id, IdSet())
+        for member_id in remove: current.discard(member_id)
+        for member_id in add: current.add(member_id)
+        if not current: del live_history[inviter_id]
+        bot.store.mark_dirty("invite_history", guild_id, inviter_id)
+    return report
+
+def audit_summary(report, fix):
+    return (
+        f"🧾 ตรวจข้อมูลคนชวน `{report['records']}` รายการ (สมาชิกตอนนี้ `{report['members']}` คน)\n"
+        f"👋 คนที่ออกไปตอนบอทออฟไลน์: `{report['departed']}` คน\n"
+        f"📉 แต้มไม่ตรง: `{report['inviters_drifted']}` คน รวม `{report['points_drift']}` แต้ม\n"
+        f"👥 ประวัติการชวนไม่ตรง: `{report['history_drifted']}` คน\n"
+        + ("✅ แก้ไขข้อมูลให้ตรงแล้ว!" if fix else "ℹ️ ใช้ `/audit fix:True` เพื่อแก้ไขข้อมูลให้ตรง")
+    )
+
+async def run_audit_cli(token, fix, guild_ids):
+    client = discord.Client(intents=intents)
+    async with client:
+        await client.login(token)
+        for guild_id in [int(g) for g in guild_ids] or list(bot.db["invited_by"]):
+            guild = await client.fetch_guild(int(guild_id))
+            report = await audit_guild(guild, fix)
+            print(f"[{guild_id}] {json.dumps(report)}")
+    await bot.store.close()
+
+@bot.tree.command(name="audit", description="ตรวจและซ่อมแต้มที่ไม่ตรงกับข้อมูลคนชวน")
+@app_commands.default_permissions(administrator=True)
+async def audit(interaction: discord.Interaction, fix: bool = False):
+    await interaction.response.defer(ephemeral=True)
+    report = await audit_guild(interaction.guild, fix)
+    if fix: await update_leaderboard(interaction.guild)
+    await interaction.followup.send(embed=discord.Embed(title="🔎 ผลการตรวจข้อมูล", description=audit_summary(report, fix), color=0x3498DB), ephemeral=True)
+
+@bot.tree.command(name="pending_joins", description="ดูคนที่เข้ามาแต่บอทระบุคนชวนไม่ได้")
 @app_commands.default_permissions(administrator=True)
-async def backup_data(interaction: discord.Interaction):
-    if not os.path.exists(DATA_FILE):
-        await interaction.response.send_message("❌ ยังไม่มีไฟล์ข้อมูลเลยครับ", ephemeral=True)
+async def pending_joins(interaction: discord.Interaction):
+    pending = bot.db.get("pending_joins", {}).get(interaction.guild.id, {})
+    if not pending:
+        await interaction.response.send_message("✅ ไม่มีคนที่รอเลือกคนชวนครับ", ephemeral=True)
         return
-    
+    lines = []
+    for member_id, entry in itertools.islice(pending.items(), 15):
+        candidates = entry["candidates"]
+        shown = ", ".join(f"<@{inviter_id}>" for inviter_id in candidates[:5]) + (f" +{len(candidates) - 5}" if len(candidates) > 5 else "")
+        lines.append(f"{'🐣' if entry['young'] else '👤'} <@{member_id}> `{member_id}` <t:{entry['at']}:R> ➔ {shown}")
+    desc = "\n".join(lines)
+    if len(pending) > 15: desc += f"\n...และอีก {len(pending) - 15} คน"
+    desc += "\n\n🐣 = ไอดีไก่ (เตะไปแล้ว เลือกคนชวนแล้วจะนับเป็นยอดไอดีไก่ของคนนั้น)\nใช้ `/assign_join` ใส่เลขไอดีกับคนชวนเพื่อนับให้"
+    await interaction.response.send_message(embed=discord.Embed(title=f"❔ รอเลือกคนชวน {len(pending)} คน", description=desc, color=0x95A5A6), ephemeral=True)
+
+@bot.tree.command(name="assign_join", description="เลือกคนชวนให้คนที่บอทระบุคนชวนไม่ได้")
+@app_commands.describe(member_id="เลขไอดีของคนที่เข้ามา (ดูจาก /pending_joins)", inviter="คนชวน (ต้องเป็นหนึ่งในคนที่มีสิทธิ์เป็นคนชวน)")
+@app_commands.default_permissions(administrator=True)
+async def assign_join(interaction: discord.Interaction, member_id: str, inviter: discord.Member):
+    guild = interaction.guild
+    pending = bot.db.get("pending_joins", {}).get(guild.id, {})
+    entry = pending.get(int(member_id)) if member_id.isdigit() else None
+    if entry is None:
+        await interaction.response.send_message("❌ ไม่พบคนนี้ในรายการรอเลือกคนชวนครับ ดูได้จาก `/pending_joins`", ephemeral=True)
+        return
+    if inviter.id not in entry["candidates"]:
+        await interaction.response.send_message(f"❌ ตอนที่คนนี้เข้ามา ไม่มีใครใช้ลิงก์ของ {inviter.mention} เลยครับ เลือกจากรายชื่อใน `/pending_joins` นะ", ephemeral=True)
+        return
+    member_id = int(member_id)
+    del pending[member_id]
+    bot.store.mark_dirty("pending_joins", guild.id, member_id)
+    member = guild.get_member(member_id)
+    if entry["young"]:
+        fake_count = count_fake(guild.id, inviter.id)
+        await interaction.response.send_message(f"✅ นับ <@{member_id}> เป็นไอดีไก่ของ {inviter.mention} แล้ว (ครั้งที่ **{fake_count}**)", ephemeral=True)
+    elif member is None:
+        await interaction.response.send_message(f"⚠️ <@{member_id}> ออกจากเซิร์ฟไปแล้ว เลยไม่นับแต้มให้ครับ", ephemeral=True)
+    else:
+        await interaction.response.send_message(f"✅ นับ {member.mention} ให้ {inviter.mention} แล้วครับ", ephemeral=True)
+        await credit_join(member, inviter.id)
+
+@bot.tree.command(name="backup", description="ดึงไฟล์ข้อมูลสำรองของเซิร์ฟนี้")
+@app_commands.describe(incremental="เอาเฉพาะส่วนที่เปลี่ยนไปตั้งแต่ Backup ครั้งก่อน")
+@app_commands.default_permissions(administrator=True)
+async def backup_data(interaction: discord.Interaction, incremental: bool = False):
+    guild_id = interaction.guild.id
     await interaction.response.defer(ephemeral=True)
+    base = bot.last_backups.get(guild_id)
+    touched = bot.store.take_touched(guild_id, base)
+    note = ""
+    if not incremental: touched = None
+    elif touched is None: note = "\n(ไม่มีประวัติการเปลี่ยนแปลงตั้งแต่ Backup ครั้งก่อน เช่นบอทเพิ่งรีสตาร์ท เลยส่งแบบเต็มให้แทน)"
+    started = time.time()
+    fd, path = tempfile.mkstemp(suffix=".ndjson.gz")
+    os.close(fd)
+    sent = False
     try:
-        user = interaction.user
-        await user.send("📁 **นี่คือไฟล์ Backup ข้อมูลเซิร์ฟเวอร์ครับ**\n**", file=discord.File(DATA_FILE))
-        await interaction.followup.send("✅ ส่งไฟล์ Backup เข้าแชทส่วนตัว (DM) ให้เรียบร้อยแล้วครับ!", ephemeral=True)
+        count = await write_backup(path, bot.db, guild_id, touched, base if touched is not None else None)
+        size = os.path.getsize(path)
+        if size > ATTACHMENT_LIMIT:
+            await interaction.followup.send(f"❌ ไฟล์ Backup ใหญ่เกินไป ({size / 1024 / 1024:.1f} MB) ลองใช้ `incremental` หรือรัน `python main.py export {guild_id}` บนเครื่องที่รันบอทแทนนะครับ", ephemeral=True)
+            return
+        mode = "full" if touched is None else "inc"
+        filename = f"backup-{guild_id}-{mode}-{time.strftime('%Y%m%d-%H%M%S')}.ndjson.gz"
+        await interaction.user.send(f"📁 **นี่คือไฟล์ Backup ของเซิร์ฟ {interaction.guild.name} ครับ** ({count} รายการ)", file=discord.File(path, filename=filename))
+        sent = True
+        bot.last_backups[guild_id] = started
+        await interaction.followup.send("✅ ส่งไฟล์ Backup เข้าแชทส่วนตัว (DM) ให้เรียบร้อยแล้วครับ!" + note, ephemeral=True)
     except discord.Forbidden:
         await interaction.followup.send("❌ ส่งให้ไม่ได้ครับ แอดมินต้องเปิดรับข้อความ DM ก่อนนะ", ephemeral=True)
+    finally:
+        # nothing was delivered, so the next incremental backup can't build on this one
+        if not sent: bot.store.touched[guild_id] = None
+        os.remove(path)
+
+@bot.tree.command(name="restore", description="โหลดข้อมูลจากไฟล์ Backup ของเซิร์ฟนี้")
+@app_commands.default_permissions(administrator=True)
+async def restore_data(interaction: discord.Interaction, archive: discord.Attachment):
+    guild_id = interaction.guild.id
+    if guild_id in bot.restoring:
+        await interaction.response.send_message("⏳ กำลังโหลดข้อมูลอยู่แล้วครับ รอให้เสร็จก่อนนะ", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True)
+    bot.restoring.add(guild_id)
+    fd, path = tempfile.mkstemp(suffix=".ndjson.gz")
+    os.close(fd)
+    try:
+        await archive.save(path)
+        try: header, count = await asyncio.to_thread(check_backup, path, guild_id)
+        except (OSError, EOFError, ValueError) as e:
+            await interaction.followup.send(f"❌ ไฟล์ Backup ใช้ไม่ได้: {e}", ephemeral=True)
+            return
+        await restore_backup(path, bot.store, guild_id, header)
+        bot.rankings.pop(guild_id, None)
+        bot.tiers.pop(guild_id, None)
+        bot.campaigns.load(guild_id)
+        await update_leaderboard(interaction.guild)
+        kind = "แบบเต็ม" if header["mode"] == "full" else "เฉพาะส่วนที่เปลี่ยน"
+        await interaction.followup.send(f"✅ โหลดข้อมูล{kind}เรียบร้อยแล้ว ({count} รายการ)", ephemeral=True)
+    finally:
+        bot.restoring.discard(guild_id)
+        os.remove(path)
 
 @bot.tree.command(name="check_user", description="เช็คประวัติ")
 @app_commands.default_permissions(administrator=True)
 async def check_user(interaction: discord.Interaction, member: discord.Member):
-    guild_id, inviter_id = str(interaction.guild.id), str(member.id)
+    guild_id, inviter_id = interaction.guild.id, member.id
     real = bot.db.get("real_invites", {}).get(guild_id, {}).get(inviter_id, 0)
     fake = bot.db.get("fake_invite_counts", {}).get(guild_id, {}).get(inviter_id, 0)
-    history = bot.db.get("invite_history", {}).get(guild_id, {}).get(inviter_id, [])
+    history = bot.db.get("invite_history", {}).get(guild_id, {}).get(inviter_id, ())
     
-    mentions = [f"<@{uid}>" for uid in history[:20]]
+    mentions = [f"<@{uid}>" for uid in itertools.islice(history, 20)]
     hist_text = ", ".join(mentions) if mentions else "ไม่เคยชวนใครเข้าเลย (หรือคนที่ชวนมากดออกหมดแล้ว)"
     if len(history) > 20: hist_text += f" ...และอีก {len(history)-20} คน"
 
@@ -314,41 +1942,202 @@ async def check_user(interaction: discord.Interaction, member: discord.Member):
     embed.add_field(name="👥 รายชื่อคนที่ชวนมา (ที่ยังอยู่ในเซิร์ฟ)", value=hist_text, inline=False)
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
+@bot.tree.command(name="rank", description="ดูอันดับการชวนเพื่อน")
+async def rank_cmd(interaction: discord.Interaction, member: discord.Member = None):
+    member = member or interaction.user
+    guild_id, user_id = interaction.guild.id, member.id
+    ranking = bot.ranking(guild_id)
+    rank = ranking.rank(user_id)
+    points = bot.db["real_invites"].get(guild_id, {}).get(user_id, 0)
+    if rank: desc = f"{member.mention} อยู่อันดับ **#{rank}** จาก {len(ranking)} คน ด้วยแต้มสะสม `{points}` แต้ม 🏆"
+    else: desc = f"{member.mention} ยังไม่ติดอันดับเลย ชวนเพื่อนเข้ามาสักคนก่อนนะ 🚀"
+    await interaction.response.send_message(embed=discord.Embed(title="🏆 อันดับนักเชิญเพื่อน", description=desc, color=0xFFD700), ephemeral=True)
+
 @bot.tree.command(name="set_multiplier", description="เปิดกิจกรรมคูณแต้ม")
 @app_commands.default_permissions(administrator=True)
-async def set_multiplier(interaction: discord.Interaction, multiplier: int):
-    multiplier = max(1, multiplier)
-    bot.db.setdefault("multipliers", {})[str(interaction.guild.id)] = multiplier
-    save_data(bot.db)
+async def set_multiplier(interaction: discord.Interaction, multiplier: app_commands.Range[int, 1, MULTIPLIER_MAX]):
+    bot.db.setdefault("multipliers", {})[interaction.guild.id] = multiplier
+    bot.store.mark_dirty("multipliers", interaction.guild.id)
+    bot.campaigns.refresh(interaction.guild.id)
     await interaction.response.send_message(f"✅ ตอนนี้เปิดโหมดกิจกรรมแล้ว! ใครชวนเพื่อนเข้ามาจะได้แต้ม **x{multiplier}** ครับ!")
 
+@bot.tree.command(name="campaign_add", description="ตั้งเวลากิจกรรมคูณแต้ม")
+@app_commands.describe(name="ชื่อแคมเปญ", multiplier="คูณแต้มกี่เท่า", hours="นานกี่ชั่วโมง", starts_in_hours="เริ่มอีกกี่ชั่วโมง (0 = เริ่มเลย)", stack="ถ้ามีหลายแคมเปญพร้อมกันจะคิดแต้มยังไง")
+@app_commands.choices(stack=[
+    app_commands.Choice(name="เอาค่าที่สูงสุด", value="max"),
+    app_commands.Choice(name="บวกเพิ่ม", value="add"),
+    app_commands.Choice(name="คูณซ้อน", value="multiply"),
+])
+@app_commands.default_permissions(administrator=True)
+async def campaign_add(interaction: discord.Interaction, name: app_commands.Range[str, 1, 100], multiplier: app_commands.Range[int, 1, MULTIPLIER_MAX], hours: app_commands.Range[float, 0.01, 2160.0], starts_in_hours: app_commands.Range[float, 0.0, 2160.0] = 0.0, stack: str = "max"):
+    guild_id = interaction.guild.id
+    campaigns = bot.db.setdefault("campaigns", {}).setdefault(guild_id, {})
+    bot.campaigns.prune(guild_id)
+    if len(campaigns) >= CAMPAIGN_LIMIT:
+        await interaction.response.send_message(f"⚠️ ตั้งแคมเปญไว้ได้สูงสุด {CAMPAIGN_LIMIT} อันครับ ลองจบหรือยกเลิกอันเก่าก่อนนะ", ephemeral=True)
+        return
+    start = time.time() + starts_in_hours * 3600
+    campaign_id = str(max(map(int, campaigns), default=0) + 1)
+    campaign = campaigns[campaign_id] = {"name": name, "multiplier": multiplier, "start": start, "end": start + hours * 3600, "stack": stack}
+    bot.store.mark_dirty("campaigns", guild_id)
+    bot.campaigns.schedule(guild_id, campaign)
+    bot.campaigns.refresh(guild_id)
+    when = "เริ่มแล้วตอนนี้" if starts_in_hours == 0 else f"เริ่ม <t:{int(start)}:f> (<t:{int(start)}:R>)"
+    await interaction.response.send_message(f"✅ ตั้งแคมเปญ **#{campaign_id} {name}** x{multiplier} แล้วครับ! {when} จบ <t:{int(campaign['end'])}:f>")
+    if starts_in_hours == 0: await update_leaderboard(interaction.guild)
+
+@bot.tree.command(name="campaign_list", description="ดูแคมเปญคูณแต้มทั้งหมด")
+@app_commands.default_permissions(administrator=True)
+async def campaign_list(interaction: discord.Interaction):
+    guild_id = interaction.guild.id
+    campaigns = bot.db.get("campaigns", {}).get(guild_id, {})
+    if not campaigns:
+        await interaction.response.send_message("ยังไม่มีแคมเปญเลยครับ ใช้ `/campaign_add` สร้างได้เลย", ephemeral=True)
+        return
+    now = time.time()
+    stacking = {"max": "เอาค่าที่สูงสุด", "add": "บวกเพิ่ม", "multiply": "คูณซ้อน"}
+    lines = []
+    for campaign_id, c in sorted(campaigns.items(), key=lambda item: item[1]["start"]):
+        status = "🟢" if c["start"] <= now < c["end"] else "⏳" if now < c["start"] else "⚪"
+        lines.append(f"{status} **#{campaign_id} {c['name']}** x{c['multiplier']} ({stacking[c['stack']]}) <t:{int(c['start'])}:f> ➔ <t:{int(c['end'])}:f>")
+    desc = f"ตอนนี้ชวนเพื่อนได้แต้ม **x{bot.campaigns.multiplier(guild_id)}**\n\n" + "\n".join(lines)
+    await interaction.response.send_message(embed=discord.Embed(title="📅 แคมเปญคูณแต้ม", description=desc, color=0x3498DB), ephemeral=True)
+
+@bot.tree.command(name="campaign_end", description="จบหรือยกเลิกแคมเปญ แล้วประกาศผล")
+@app_commands.default_permissions(administrator=True)
+async def campaign_end(interaction: discord.Interaction, campaign_id: str):
+    guild_id = interaction.guild.id
+    campaigns = bot.db.get("campaigns", {}).get(guild_id, {})
+    campaign_id = campaign_id.lstrip("#")
+    c = campaigns.get(campaign_id)
+    if c is None:
+        await interaction.response.send_message("❌ ไม่พบแคมเปญนี้ครับ ดูเลขได้จาก `/campaign_list`", ephemeral=True)
+        return
+    now = time.time()
+    if now < c["start"]:
+        del campaigns[campaign_id]
+        bot.store.mark_dirty("campaigns", guild_id)
+        await interaction.response.send_message(f"🗑️ ยกเลิกแคมเปญ **#{campaign_id} {c['name']}** แล้วครับ", ephemeral=True)
+        return
+    if now < c["end"]:
+        c["end"] = now
+        bot.store.mark_dirty("campaigns", guild_id)
+        bot.campaigns.refresh(guild_id)
+        await update_leaderboard(interaction.guild)
+    await interaction.response.send_message(embed=bot.campaigns.results(guild_id, campaign_id, "🏁 แคมเปญจบแล้ว"))
+
 @bot.tree.command(name="permission", description="ตั้งค่ายศ")
 @app_commands.default_permissions(administrator=True)
 async def permission(interaction: discord.Interaction, role1: discord.Role, invites1: int, role2: discord.Role = None, invites2: int = 0, role3: discord.Role = None, invites3: int = 0):
-    guild_id = str(interaction.guild.id)
-    bot.db["rewards_config"][guild_id] = {str(invites1): role1.id}
+    guild_id = interaction.guild.id
+    bot.db["rewards_config"][guild_id] = {invites1: role1.id}
     desc = f"🔹 ระดับ 1: ใช้ `{invites1}` แต้ม ➔ ได้ยศ {role1.mention}\n"
     if role2 and invites2 > 0:
-        bot.db["rewards_config"][guild_id][str(invites2)] = role2.id
+        bot.db["rewards_config"][guild_id][invites2] = role2.id
         desc += f"🔹 ระดับ 2: ใช้ `{invites2}` แต้ม ➔ ได้ยศ {role2.mention}\n"
     if role3 and invites3 > 0:
-        bot.db["rewards_config"][guild_id][str(invites3)] = role3.id
+        bot.db["rewards_config"][guild_id][invites3] = role3.id
         desc += f"🔹 ระดับ 3: ใช้ `{invites3}` แต้ม ➔ ได้ยศ {role3.mention}\n"
-    save_data(bot.db)
+    bot.store.mark_dirty("rewards_config", guild_id)
+    bot.tiers.pop(guild_id, None)
     await interaction.response.send_message(embed=discord.Embed(title="⚙️ ตั้งค่ายศรางวัลเสร็จแล้ว!", description=desc, color=0x3498DB))
 
+async def resync_roles_task(guild, progress, remove_extra):
+    guild_id = guild.id
+    tiers = bot.reward_tiers(guild_id)
+    tier_roles = {role_id: guild.get_role(role_id) for role_id in tiers.role_ids}
+    points = bot.db["real_invites"].get(guild_id, {})
+    cursors = bot.db.setdefault("resync_cursor", {})
+    members = sorted(guild.members, key=lambda m: m.id)
+    start = bisect.bisect_right([m.id for m in members], cursors.get(guild_id, 0))
+    added = removed = 0
+    for i in range(start, len(members), RESYNC_BATCH):
+        for member in members[i:i + RESYNC_BATCH]:
+            earned = set(tiers.earned(points.get(member.id, 0)))
+            has = {role.id for role in member.roles}
+            to_add = [tier_roles[r] for r in earned - has if tier_roles.get(r)]
+            to_remove = [tier_roles[r] for r in (has & tier_roles.keys()) - earned if tier_roles.get(r)] if remove_extra else []
+            try:
+                if to_add: await member.add_roles(*to_add, reason="resync_roles")
+                if to_remove: await member.remove_roles(*to_remove, reason="resync_roles")
+                added, removed = added + len(to_add), removed + len(to_remove)
+            except discord.NotFound: pass
+            except discord.Forbidden:
+                await progress.edit(content="❌ บอทยศต่ำกว่ายศรางวัล เลยแจกยศไม่ได้ ปรับลำดับยศแล้วใช้ `/resync_roles` อีกครั้งเพื่อทำต่อนะครับ")
+                return
+        done = min(i + RESYNC_BATCH, len(members))
+        cursors[guild_id] = members[done - 1].id
+        bot.store.mark_dirty("resync_cursor", guild_id)
+        try: await progress.edit(content=f"🔄 กำลังซิงค์ยศ... `{done}/{len(members)}` คน (เพิ่มยศ {added} / ถอดยศ {removed})")
+        except discord.HTTPException: pass
+        await asyncio.sleep(RESYNC_DELAY)
+    cursors.pop(guild_id, None)
+    bot.store.mark_dirty("resync_cursor", guild_id)
+    await progress.edit(content=f"✅ ซิงค์ยศครบ `{len(members)}` คนแล้ว! (เพิ่มยศ {added} / ถอดยศ {removed})")
+
+@bot.tree.command(name="resync_roles", description="ซิงค์ยศรางวัลของทุกคนให้ตรงกับแต้ม")
+@app_commands.default_permissions(administrator=True)
+async def resync_roles(interaction: discord.Interaction, remove_extra: bool = False, restart: bool = False):
+    guild = interaction.guild
+    guild_id = guild.id
+    if not bot.db["rewards_config"].get(guild_id):
+        await interaction.response.send_message("⚠️ ยังไม่ได้ตั้งค่ายศเลย ใช้คำสั่ง `/permission` ก่อนนะครับ", ephemeral=True)
+        return
+    task = bot.resync_tasks.get(guild.id)
+    if task and not task.done():
+        await interaction.response.send_message("⏳ กำลังซิงค์ยศอยู่แล้วครับ รอให้เสร็จก่อนนะ", ephemeral=True)
+        return
+    if restart:
+        bot.db.setdefault("resync_cursor", {}).pop(guild_id, None)
+        bot.store.mark_dirty("resync_cursor", guild_id)
+    resumed = guild_id in bot.db.get("resync_cursor", {})
+    await interaction.response.send_message("🔄 เริ่มซิงค์ยศต่อจากรอบที่แล้ว..." if resumed else "🔄 เริ่มซิงค์ยศของสมาชิกทั้งหมด...", ephemeral=True)
+    progress = await interaction.channel.send("🔄 กำลังเตรียมซิงค์ยศ...")
+    bot.resync_tasks[guild.id] = asyncio.create_task(resync_roles_task(guild, progress, remove_extra))
+
+async def prune_invites_task(guild, progress):
+    metrics.inc("invite_fetches_total", source="prune")
+    invites = [invite for invite in await guild.invites() if invite.inviter and invite.inviter.id == bot.user.id and not invite.uses]
+    links = bot.db.get("personal_links", {}).get(guild.id, {})
+    owners = {code: user_id for user_id, code in links.items()}
+    deleted = 0
+    for i in range(0, len(invites), PRUNE_BATCH):
+        for invite in invites[i:i + PRUNE_BATCH]:
+            try: await invite.delete(reason="ลบลิงก์เชิญที่ไม่มีคนใช้")
+            except discord.NotFound: pass
+            deleted += 1
+            bot.patch_invite(guild.id, invite.code, None)
+            if invite.code in owners:
+                links.pop(owners[invite.code], None)
+                bot.store.mark_dirty("personal_links", guild.id, owners[invite.code])
+        try: await progress.edit(content=f"🧹 กำลังลบลิงก์เชิญที่ไม่มีคนใช้... `{deleted}/{len(invites)}`")
+        except discord.HTTPException: pass
+        await asyncio.sleep(PRUNE_DELAY)
+    await progress.edit(content=f"✅ ลบลิงก์เชิญที่บอทสร้างแต่ไม่มีคนใช้ไปแล้ว `{deleted}` ลิงก์!")
+
+@bot.tree.command(name="prune_invites", description="ลบลิงก์เชิญที่บอทสร้างแต่ยังไม่มีคนใช้")
+@app_commands.default_permissions(administrator=True)
+async def prune_invites(interaction: discord.Interaction):
+    task = bot.prune_tasks.get(interaction.guild.id)
+    if task and not task.done():
+        await interaction.response.send_message("⏳ กำลังลบลิงก์อยู่แล้วครับ รอให้เสร็จก่อนนะ", ephemeral=True)
+        return
+    await interaction.response.send_message("🧹 เริ่มลบลิงก์เชิญที่ไม่มีคนใช้...", ephemeral=True)
+    progress = await interaction.channel.send("🧹 กำลังโหลดรายการลิงก์เชิญ...")
+    bot.prune_tasks[interaction.guild.id] = asyncio.create_task(prune_invites_task(interaction.guild, progress))
+
 @bot.tree.command(name="set_log", description="เลือกห้องที่จะให้บอทแจ้งเตือน")
 @app_commands.default_permissions(administrator=True)
 async def set_log(interaction: discord.Interaction, channel: discord.TextChannel):
-    bot.db["log_channels"][str(interaction.guild.id)] = channel.id
-    save_data(bot.db)
+    bot.db["log_channels"][interaction.guild.id] = channel.id
+    bot.store.mark_dirty("log_channels", interaction.guild.id)
     await interaction.response.send_message(f"✅ บอทจะไปแจ้งเตือนรับยศและเตือนคนโกงที่ห้อง {channel.mention} ครับ!")
 
 @bot.tree.command(name="set_welcome", description="เลือกห้องต้อนรับคนเข้าเซิร์ฟ")
 @app_commands.default_permissions(administrator=True)
 async def set_welcome(interaction: discord.Interaction, channel: discord.TextChannel):
-    bot.db["welcome_channels"][str(interaction.guild.id)] = channel.id
-    save_data(bot.db)
+    bot.db["welcome_channels"][interaction.guild.id] = channel.id
+    bot.store.mark_dirty("welcome_channels", interaction.guild.id)
     await interaction.response.send_message(f"✅ บอทจะไปกล่าวต้อนรับสมาชิกใหม่ที่ห้อง {channel.mention} ครับ!")
 
 @bot.tree.command(name="setup_top", description="สร้างกระดานจัดอันดับ")
@@ -356,20 +2145,21 @@ async def set_welcome(interaction: discord.Interaction, channel: discord.TextCha
 async def setup_top(interaction: discord.Interaction, channel: discord.TextChannel):
     await interaction.response.send_message(f"กำลังจัดกระดาน Leaderboard ไปที่ห้อง {channel.mention} รอแป๊บนึงนะ...", ephemeral=True)
     msg = await channel.send(embed=discord.Embed(title="📊 Leaderboard...", description="กำลังโหลดข้อมูล... ⏳"))
-    bot.db["top_messages"][str(interaction.guild.id)] = {"channel": channel.id, "message": msg.id}
-    save_data(bot.db)
+    bot.db["top_messages"][interaction.guild.id] = {"channel": channel.id, "message": msg.id}
+    bot.store.mark_dirty("top_messages", interaction.guild.id)
     await update_leaderboard(interaction.guild)
 
 @bot.tree.command(name="ประกาศ", description="ส่งประกาศกิจกรรม")
 @app_commands.default_permissions(administrator=True)
 async def announce_event(interaction: discord.Interaction):
-    guild_id = str(interaction.guild.id)
+    guild_id = interaction.guild.id
     if not bot.db["rewards_config"].get(guild_id):
         await interaction.response.send_message("⚠️ แอดมินต้องใช้คำสั่ง `/permission` ตั้งค่ายศก่อน ถึงจะประกาศได้นะครับ", ephemeral=True)
         return
         
-    sorted_rewards = sorted([(int(k), v) for k, v in bot.db["rewards_config"][guild_id].items()])
-    mult = bot.db.get("multipliers", {}).get(guild_id, 1)
+    tiers = bot.reward_tiers(guild_id)
+    sorted_rewards = list(zip(tiers.thresholds, tiers.role_ids))
+    mult = bot.campaigns.multiplier(guild_id)
     
     desc = (
         "🎉 **ประกาศๆ! กิจกรรมชวนเพื่อนเข้าเซิร์ฟ แจกยศฟรีมาแล้วจ้า!** 🚀\n"
@@ -387,6 +2177,9 @@ async def announce_event(interaction: discord.Interaction):
     
     if mult > 1: 
         desc += f"\n🔥 **ตอนนี้แอดมินเปิดโหมด x{mult}! ชวนเพื่อน 1 คน รับไปเลย {mult} แต้ม**\n"
+    for campaign_id in bot.campaigns.running(guild_id)[:3]:
+        c = bot.db["campaigns"][guild_id][campaign_id]
+        desc += f"\n📅 **แคมเปญ {c['name']}** (x{c['multiplier']}) ถึง <t:{int(c['end'])}:f> (<t:{int(c['end'])}:R>)\n" + bot.campaigns.describe(guild_id, campaign_id, 3) + "\n"
         
     desc += "\n🎁 **ของรางวัลตามระดับ**\n"
     
@@ -407,9 +2200,22 @@ async def announce_event(interaction: discord.Interaction):
 @bot.tree.command(name="ping", description="เช็คความเร็วของบอท")
 async def ping(interaction: discord.Interaction):
     latency = round(bot.latency * 1000)
+    desc = f"ความเร็วในการตอบสนอง: `{latency}ms` ⚡"
+    load = await bot.shard_load()
+    if len(load) > 1:
+        if interaction.guild: desc += f"\nเซิร์ฟนี้อยู่ shard `{interaction.guild.shard_id}`"
+        lines = []
+        for shard_id, worker, pid, guilds, members, shard_latency, queued, updated_at in load[:20]:
+            online = time.time() - updated_at < SHARD_STALE
+            line = f"{'🟢' if online else '🔴'} shard {shard_id} (worker {worker}): {guilds} เซิร์ฟ, {members} คน"
+            if shard_latency is not None: line += f", `{round(shard_latency * 1000)}ms`"
+            if queued: line += f", รอคำนวณคนชวน {queued} คน"
+            lines.append(line)
+        if len(load) > 20: lines.append(f"...และอีก {len(load) - 20} shard")
+        desc += "\n\n" + "\n".join(lines)
     embed = discord.Embed(
         title="🏓 Pong!",
-        description=f"ความเร็วในการตอบสนอง: `{latency}ms` ⚡",
+        description=desc,
         color=0x2ECC71
     )
     await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -422,7 +2228,7 @@ async def help_cmd(interaction: discord.Interaction):
         color=0x3498DB
     )
     
-    embed.add_field(name="🔹 คำสั่งทั่วไป", value="`/ping` - เช็คความเร็วของบอท\n`/help` - ดูคู่มือการใช้งานนี้", inline=False)
+    embed.add_field(name="🔹 คำสั่งทั่วไป", value="`/ping` - เช็คความเร็วของบอท\n`/rank` - ดูอันดับการชวนเพื่อน\n`/help` - ดูคู่มือการใช้งานนี้", inline=False)
     
     if interaction.user.guild_permissions.administrator:
         admin_cmds = (
@@ -432,8 +2238,17 @@ async def help_cmd(interaction: discord.Interaction):
             "`/set_log` - เลือกห้องส่งแจ้งเตือนต่างๆ\n"
             "`/set_welcome` - เลือกห้องต้อนรับคนเข้า\n"
             "`/check_user` - ส่องประวัติคนชวนแบบละเอียด\n"
+            "`/resync_roles` - ซิงค์ยศรางวัลของทุกคนให้ตรงกับแต้ม\n"
+            "`/audit` - ตรวจและซ่อมแต้มที่ไม่ตรงกัน\n"
+            "`/pending_joins` - ดูคนที่เข้ามาแต่บอทระบุคนชวนไม่ได้\n"
+            "`/assign_join` - เลือกคนชวนให้คนที่รอตรวจ\n"
+            "`/prune_invites` - ลบลิงก์เชิญที่บอทสร้างแต่ไม่มีคนใช้\n"
             "`/set_multiplier` - เปิดกิจกรรมคูณแต้ม\n"
-            "`/backup` - ดึงไฟล์ข้อมูลสำรองมาเก็บไว้"
+            "`/campaign_add` - ตั้งเวลาแคมเปญคูณแต้ม (เริ่ม/จบเอง)\n"
+            "`/campaign_list` - ดูแคมเปญทั้งหมด\n"
+            "`/campaign_end` - จบแคมเปญแล้วประกาศอันดับ\n"
+            "`/backup` - ดึงไฟล์ข้อมูลสำรองของเซิร์ฟนี้ (เลือกเอาเฉพาะส่วนที่เปลี่ยนได้)\n"
+            "`/restore` - โหลดข้อมูลกลับจากไฟล์ Backup"
         )
         embed.add_field(name="⚙️ คำสั่งสำหรับผู้ดูแล (Admin)", value=admin_cmds, inline=False)
     else:
@@ -442,9 +2257,33 @@ async def help_cmd(interaction: discord.Interaction):
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
 if __name__ == "__main__":
-    keep_alive()
+    if sys.argv[1:2] == ["migrate"]:
+        migrate_json_to_sqlite(*sys.argv[2:4])
+        print("📦 ย้ายข้อมูลไปที่ SQLite เรียบร้อยแล้ว")
+        sys.exit(0)
+    if sys.argv[1:2] == ["export"]:
+        guild_id = int(sys.argv[2])
+        path = sys.argv[3] if len(sys.argv) > 3 else f"backup-{guild_id}.ndjson.gz"
+        count = asyncio.run(write_backup(path, open_store().data, guild_id))
+        print(f"📁 บันทึก Backup ของเซิร์ฟ {guild_id} ไว้ที่ {path} ({count} รายการ)")
+        sys.exit(0)
+    if sys.argv[1:2] == ["restore"]:
+        # for moving a guild between deployments; refused while a bot is running (see lock_store)
+        async def run_restore(path):
+            header, count = check_backup(path)
+            store = open_store()
+            await restore_backup(path, store, int(header["guild"]), header)
+            await store.close()
+            return header, count
+        header, count = asyncio.run(run_restore(sys.argv[2]))
+        print(f"📥 โหลด Backup ของเซิร์ฟ {header['guild']} แล้ว ({count} รายการ)")
+        sys.exit(0)
     token = os.getenv("TOKEN") 
     if not token:
         print("❌ ไม่พบ Token! อย่าลืมไปใส่ 'TOKEN' ใน Environment Variables ของ Render นะ")
+    elif sys.argv[1:2] == ["audit"]:
+        args = sys.argv[2:]
+        asyncio.run(run_audit_cli(token, "--fix" in args, [a for a in args if a != "--fix"]))
     else:
-        bot.run(token)
+        # a SIGTERM ends bot.run with the main task's cancellation, after close() has run
+        with contextlib.suppress(asyncio.CancelledError): bot.run(token)
@@ -0,0 +1,91 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Runs the bot as WORKER_COUNT `main.py` processes, each with its own slice of SHARD_COUNT
+# gateway shards, all sharing one SQLite file, and restarts any worker that exits.
+#   SHARD_COUNT=8 WORKER_COUNT=4 python supervisor.py
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", 0)) or min(os.cpu_count() or 1, SHARD_COUNT or 1)
+WORKER_STAGGER = float(os.getenv("WORKER_STAGGER", 5))
+BASE_PORT = int(os.getenv("PORT", 8080))
+DATA_FILE = os.getenv("DATA_FILE", "bot_data.json")
+SQLITE_FILE = os.getenv("SQLITE_FILE", "bot_data.sqlite3")
+
+class Worker:
+    def __init__(self, worker_id, shard_ids):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.proc = None
+        self.started = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+    def start(self):
+        env = dict(os.environ, SHARD_COUNT=str(SHARD_COUNT), SHARD_IDS=",".join(map(str, self.shard_ids)),
+                   WORKER_ID=str(self.worker_id), PORT=str(BASE_PORT + self.worker_id), STORAGE_ENGINE="sqlite")
+        self.proc = subprocess.Popen([sys.executable, os.path.join(HERE, "main.py")], env=env)
+        self.started = time.monotonic()
+        print(f"🚀 เริ่ม worker {self.worker_id} (shard {self.shard_ids}, pid {self.proc.pid})", flush=True)
+
+    def check(self):
+        if self.proc is None or self.proc.poll() is None: return
+        code = self.proc.returncode
+        self.proc = None
+        # a worker that stayed up for a minute gets a fresh backoff
+        self.failures = 0 if time.monotonic() - self.started > 60 else self.failures + 1
+        delay = min(60, 2 ** self.failures)
+        self.restart_at = time.monotonic() + delay
+        print(f"⚠️ worker {self.worker_id} หยุดทำงาน (exit {code}) จะเริ่มใหม่ใน {delay}s", flush=True)
+
+def supervise():
+    if not SHARD_COUNT:
+        print("❌ ต้องตั้ง SHARD_COUNT ก่อนนะ")
+        return 1
+    if not os.getenv("TOKEN"):
+        print("❌ ไม่พบ Token! อย่าลืมไปใส่ 'TOKEN' ใน Environment Variables นะ")
+        return 1
+    # migrate once here instead of letting every worker race to do it
+    if not os.path.exists(SQLITE_FILE) and os.path.exists(DATA_FILE):
+        subprocess.run([sys.executable, os.path.join(HERE, "main.py"), "migrate", DATA_FILE, SQLITE_FILE], check=True)
+
+    count = min(WORKER_COUNT, SHARD_COUNT)
+    workers = [Worker(w, list(range(w, SHARD_COUNT, count))) for w in range(count)]
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i, worker in enumerate(workers):
+        if stopping: break
+        # gateway identifies are rate limited, so workers connect one after another
+        if i: time.sleep(WORKER_STAGGER)
+        worker.start()
+    while not stopping:
+        time.sleep(1)
+        for worker in workers:
+            worker.check()
+            if worker.proc is None and time.monotonic() >= worker.restart_at and not stopping: worker.start()
+
+    print("🛑 กำลังปิด worker ทั้งหมด...", flush=True)
+    for worker in workers:
+        # SIGINT lets bot.run close cleanly, which flushes the store
+        if worker.proc: worker.proc.send_signal(signal.SIGINT)
+    deadline = time.monotonic() + 20
+    for worker in workers:
+        if worker.proc is None: continue
+        try: worker.proc.wait(timeout=max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired: worker.proc.kill()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(supervise())